@@ -0,0 +1,264 @@
+"""
+Async server mode: the same routes and message formats as main.py, served by an
+asyncio event loop instead of a thread per socket.
+
+    python asgi_app.py [--debug]
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+
+Each dashboard or camera socket is a coroutine. A hub gets one bridge per event loop,
+which subscribes to it while any socket on that loop is listening. Events wait in a
+bounded buffer until the loop drains it (one call_soon_threadsafe per drain, not per
+event), and the loop fans them out to small per-socket buffers that drop their oldest
+events for slow clients, as BroadcastHub does. An idle socket costs a
+buffer and a suspended coroutine instead of a parked OS thread, so one process can
+hold hundreds of them. Capture, encoding, inference and triage keep running on their
+own worker threads, and anything that might block (starting a camera, opening the
+microphone) is run in the default executor.
+
+Plain HTTP routes are served by the Flask app from main.py through a WSGI adapter.
+Needs starlette and uvicorn (pip install starlette uvicorn[standard]); a2wsgi is used
+for the adapter when it is installed.
+"""
+import asyncio
+import contextlib
+import json
+import sys
+import threading
+from collections import deque
+
+try:
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.routing import Mount, WebSocketRoute
+    from starlette.websockets import WebSocketDisconnect
+except ImportError as e:
+    raise ImportError(
+        "The async server needs starlette and uvicorn: pip install starlette uvicorn[standard]") from e
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import main
+import metrics
+from listener import get_listener
+from speech import get_speech_worker
+
+
+class AsyncSubscription:
+    """One socket's buffer. Only touched from the event loop."""
+
+    def __init__(self, buffer_size):
+        self._buffer = deque(maxlen=buffer_size)
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+
+    def push(self, event):
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(event)
+        self._ready.set()
+
+    async def get(self):
+        """Returns the next event, or None once the subscription is closed."""
+        while not self._buffer and not self.closed:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._buffer.popleft() if self._buffer else None
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    def __len__(self):
+        return len(self._buffer)
+
+
+class HubBridge:
+    """
+    Carries one BroadcastHub's events into an event loop and fans them out there.
+    push(), close(), dropped, subscribers and __len__ are what the hub uses from its
+    threads. Events wait in a bounded thread-side buffer that drops its oldest, and
+    at most one drain is scheduled on the loop at a time, so a busy loop never
+    builds up a backlog of its own.
+    """
+
+    def __init__(self, hub, loop):
+        self.hub = hub
+        self.loop = loop
+        self.history = deque(maxlen=hub.history.maxlen)
+        self.clients = set()
+        # Snapshot of clients for the hub's threads; the set is only touched on the loop
+        self._client_list = ()
+        self._pending = deque(maxlen=hub.buffer_size)
+        self._scheduled = False
+        self._lock = threading.Lock()
+        self._dropped = 0
+        hub.subscribe(self)
+
+    @property
+    def dropped(self):
+        return self._dropped + sum(client.dropped for client in self._client_list)
+
+    @property
+    def subscribers(self):
+        return len(self._client_list)
+
+    def push(self, event):
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append(event)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.loop.call_soon_threadsafe(self._drain)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self._close)
+
+    def __len__(self):
+        return len(self._pending) + sum(len(client) for client in self._client_list)
+
+    def _drain(self):
+        with self._lock:
+            events = list(self._pending)
+            self._pending.clear()
+            self._scheduled = False
+        for event in events:
+            self.history.append(event)
+            for client in self.clients:
+                client.push(event)
+
+    def _close(self):
+        for client in self.clients:
+            client.close()
+
+    def subscribe(self):
+        client = AsyncSubscription(self.hub.buffer_size)
+        for event in self.history:
+            client.push(event)
+        self.clients.add(client)
+        self._client_list = tuple(self.clients)
+        return client
+
+    def unsubscribe(self, client):
+        if client in self.clients:
+            self.clients.discard(client)
+            self._client_list = tuple(self.clients)
+            # Keep the hub's drop count from going backwards
+            self._dropped += client.dropped
+        client.close()
+
+
+_bridges = {}
+
+
+def get_bridge(hub):
+    """The running loop's bridge for hub, subscribing on first use."""
+    loop = asyncio.get_running_loop()
+    bridge = _bridges.get((id(hub), loop))
+    if bridge is None:
+        bridge = _bridges[(id(hub), loop)] = HubBridge(hub, loop)
+    return bridge
+
+
+def release_bridge(bridge, subscription):
+    """Drops a socket's subscription, and the bridge itself once no sockets are left."""
+    bridge.unsubscribe(subscription)
+    if not bridge.clients:
+        # Nobody on this loop is listening; stop taking the hub's events
+        _bridges.pop((id(bridge.hub), bridge.loop), None)
+        bridge.hub.unsubscribe(bridge)
+
+
+async def wait_disconnect(websocket):
+    """Returns once the client closes the socket; clients never send anything else we need."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def stream_hub(websocket, hub, binary=False):
+    """Sends every event published on hub to websocket until the client goes away."""
+    await websocket.accept()
+    bridge = get_bridge(hub)
+    subscription = bridge.subscribe()
+
+    async def send():
+        while True:
+            event = await subscription.get()
+            if event is None:
+                return
+            with metrics.timed("frontend_send", hub=hub.name):
+                if binary:
+                    await websocket.send_bytes(bytes(event))
+                else:
+                    await websocket.send_text(json.dumps(event))
+
+    sender = asyncio.ensure_future(send())
+    closed = asyncio.ensure_future(wait_disconnect(websocket))
+    try:
+        await asyncio.wait([sender, closed], return_when=asyncio.FIRST_COMPLETED)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        release_bridge(bridge, subscription)
+        for task in (sender, closed):
+            task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, WebSocketDisconnect, RuntimeError):
+            await sender
+        with contextlib.suppress(asyncio.CancelledError, WebSocketDisconnect, RuntimeError):
+            await closed
+
+
+def hub_route(hub):
+    async def endpoint(websocket):
+        await stream_hub(websocket, hub)
+    return endpoint
+
+
+async def camera_feed(websocket):
+    """Streams live JPEG frames from a shared camera worker to the client."""
+    camera_id = websocket.path_params.get("camera_id")
+    # Starting a camera opens the device, so keep it off the loop
+    worker = await asyncio.get_running_loop().run_in_executor(None, main.cameras.get, camera_id)
+    if worker is None:
+        print(f"Unknown camera: {camera_id}")
+        await websocket.close()
+        return
+
+    await stream_hub(websocket, worker.frames, binary=True)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Start the speech engine, pre-render common phrases and calibrate the
+    # microphone before any fall
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, get_speech_worker)
+    await loop.run_in_executor(None, get_listener)
+    yield
+
+
+app = Starlette(
+    routes=[
+        WebSocketRoute("/frame_update", hub_route(main.frame_update_hub)),
+        WebSocketRoute("/fall_detected", hub_route(main.fall_detected_hub)),
+        WebSocketRoute("/triage", hub_route(main.triage_message_hub)),
+        WebSocketRoute("/clip_events", hub_route(main.clip_hub)),
+        WebSocketRoute("/video_feed", camera_feed),
+        WebSocketRoute("/video_feed/{camera_id}", camera_feed),
+        # /cameras, /clips, /events, /health, /metrics, ... from the Flask app
+        Mount("/", app=WSGIMiddleware(main.app)),
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == "__main__":
+    main.DEBUG = "--debug" in sys.argv
+    uvicorn.run(app, host="0.0.0.0", port=5001)
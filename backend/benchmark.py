@@ -0,0 +1,147 @@
+"""
+End-to-end detection benchmark.
+
+Feeds a recorded video through the real capture pipeline (CameraWorker with its
+motion gate, rate controller and pipelined VLM client) against the local mock VLM
+server, then reports fall-to-alert latency percentiles, frames processed per second
+and bytes sent to the VLM. Falls are scripted on the mock server at the given times
+(seconds after the first captured frame); triage is replaced by a no-op agent so
+no Claude, speech or Twilio calls are made.
+
+With --replay the video is decoded as fast as the pipeline takes it (or at --speed
+times real time) on simulated timestamps, so long recordings run in a fraction of
+their length. Each VLM reply is handled --latency video seconds after its batch,
+whatever the mock's real timing, so repeated runs give the same report. Fall-to-alert
+times are then in video seconds: how much footage after the fall went by before the
+alert was raised.
+
+Usage:
+    python benchmark.py --video recording.mp4 --fall-at 10 40 --duration 60 --latency 0.8 --jitter 0.3
+    python benchmark.py --video recording.mp4 --fall-at 10 40 --duration 600 --latency 0.05 --replay
+"""
+import argparse
+import json
+import queue
+import time
+
+from broadcast import BroadcastHub
+from camera import CameraWorker
+from fusion import VerdictFusion
+from metrics import percentile
+from mock_vlm_server import MockVLM, falls_schedule, run_in_thread
+from triage_session import TriageSessionManager
+
+
+def benchmark_agent(message_q, on_escalate=None):
+    return "benchmark"
+
+
+def fall_latencies(fall_times, alert_times, start):
+    """Matches each scripted fall to the first alert after it (and before the next fall)."""
+    latencies = []
+    boundaries = [start + t for t in fall_times] + [float("inf")]
+    for fall_at, next_fall in zip(boundaries, boundaries[1:]):
+        alerts = [a for a in alert_times if fall_at <= a < next_fall]
+        latencies.append(alerts[0] - fall_at if alerts else None)
+    return latencies
+
+
+def run_benchmark(video, fall_times, duration, latency, jitter, port=8765, seed=0, replay=False,
+                  speed=0):
+    mock = MockVLM(falls_schedule(fall_times), latency, jitter, seed)
+    server = run_in_thread(mock, port=port)
+
+    fall_hub = BroadcastHub("fall_detected", buffer_size=10000)
+    worker = CameraWorker(
+        "benchmark",
+        f"replay:{video}" if replay else video,
+        triage_sessions=TriageSessionManager(
+            benchmark_agent, BroadcastHub("triage")),
+        fall_detected_hub=fall_hub,
+        frame_update_hub=BroadcastHub("frame_update"),
+        vlm_url=f"ws://127.0.0.1:{port}",
+        # Scripted falls can be seconds apart; hysteresis alone keeps them separate
+        fusion=VerdictFusion(cooldown=0),
+        replay_speed=speed,
+        # A replay charges each batch the mock's latency in video time
+        replay_latency=latency
+    )
+    alerts = fall_hub.subscribe()
+    alert_times = []
+
+    started = time.time()
+    worker.start()
+    try:
+        while time.time() - started < duration:
+            try:
+                alert = alerts.get(timeout=0.1)
+                # A replay's alerts are timed on the video's own clock, when they were raised
+                alert_times.append(alert["detected_at"] if replay else time.time())
+            except queue.Empty:
+                if not worker.running:
+                    break
+    finally:
+        worker.stop()
+        # Let the capture loop notice and close the pipeline
+        time.sleep(0.5)
+        worker.connection.close()
+        server.shutdown()
+
+    elapsed = time.time() - started
+    vlm = worker.pipeline.stats() if worker.pipeline else {}
+    source = worker.video_source
+    video_seconds = source.clock() - source.start if replay and source else elapsed
+    latencies = fall_latencies(
+        fall_times, alert_times, mock.start_ts or started)
+    detected = [round(l, 3) for l in latencies if l is not None]
+
+    return {
+        "video": str(video),
+        "elapsed_s": round(elapsed, 2),
+        "video_s": round(video_seconds, 2),
+        "speedup": round(video_seconds / elapsed, 2) if elapsed else None,
+        "falls": len(fall_times),
+        "falls_detected": len(detected),
+        "fall_to_alert_s": {
+            "p50": percentile(detected, 50),
+            "p90": percentile(detected, 90),
+            "p99": percentile(detected, 99),
+            "max": max(detected) if detected else None,
+        },
+        "frames_captured": worker.frames_captured,
+        "frames_per_s": round(worker.frames_captured / elapsed, 2) if elapsed else None,
+        "consumers": worker.consumers,
+        "vlm_batches": vlm.get("batches_sent", 0),
+        "vlm_frames": vlm.get("frames_sent", 0),
+        "vlm_bytes": vlm.get("bytes_sent", 0),
+        "vlm_bytes_per_s": round(vlm.get("bytes_sent", 0) / elapsed) if elapsed else None,
+        "vlm_discarded": vlm.get("discarded", 0),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end fall detection benchmark")
+    parser.add_argument("--video", required=True,
+                        help="Recorded video file to feed through the pipeline")
+    parser.add_argument("--fall-at", type=float, nargs="+", required=True,
+                        help="Seconds after the first frame at which the mock VLM reports a fall")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="Mock VLM seconds per batch")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--replay", action="store_true",
+                        help="Run the video faster than real time on simulated timestamps")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="Replay speed as a multiple of real time; 0 is as fast as possible")
+    parser.add_argument("--output", help="Also write the report as JSON here")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.video, sorted(args.fall_at), args.duration,
+                           args.latency, args.jitter, args.port, replay=args.replay,
+                           speed=args.speed)
+    print(json.dumps(report, indent=4))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
@@ -0,0 +1,104 @@
+"""
+In-process pub/sub for the dashboard sockets.
+
+Every subscriber gets its own bounded buffer. When a slow client falls behind, its
+oldest events are dropped instead of slowing the producer or the other clients,
+and nothing piles up when nobody is listening. A hub can replay its last few events
+to a client when it joins, so a fresh dashboard sees the current state right away.
+"""
+import queue
+import threading
+from collections import deque
+
+
+class Subscription:
+    def __init__(self, buffer_size):
+        self._buffer = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def push(self, event):
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(event)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns the next event, or None once the subscription is closed.
+        Raises queue.Empty if nothing arrives within timeout seconds.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._buffer or self.closed, timeout):
+                raise queue.Empty
+            if self._buffer:
+                return self._buffer.popleft()
+            return None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._buffer)
+
+
+class BroadcastHub:
+    """Fans every published event out to all current subscribers."""
+
+    def __init__(self, name, buffer_size=64, replay=0):
+        self.name = name
+        self.buffer_size = buffer_size
+        self.history = deque(maxlen=replay)
+        self.published = 0
+        # Drops of subscribers that have left, so the total never goes backwards
+        self._dropped = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            self.history.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+    # Lets a hub stand in wherever a queue.Queue was used as the sink
+    put = publish
+
+    def subscribe(self, subscription=None):
+        """
+        Adds a subscriber and replays the hub's history to it. By default it is a
+        Subscription; any object with push(), close(), dropped and __len__ will do
+        (like the asyncio bridge in asgi_app.py). One that serves several clients
+        reports how many in a subscribers attribute.
+        """
+        if subscription is None:
+            subscription = Subscription(self.buffer_size)
+        with self._lock:
+            for event in self.history:
+                subscription.push(event)
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+                self._dropped += subscription.dropped
+        subscription.close()
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            dropped = self._dropped
+        return {
+            "subscribers": sum(getattr(s, "subscribers", 1) for s in subscribers),
+            "published": self.published,
+            "buffered": sum(len(s) for s in subscribers),
+            "dropped": dropped + sum(s.dropped for s in subscribers),
+        }
@@ -1,18 +1,37 @@
 import os
+import threading
+import time
+from concurrent.futures import Future
+from xml.sax.saxutils import escape
 
 import anthropic
+import llm_cache
 from dotenv import load_dotenv
 from openai import OpenAI
 from twilio.rest import Client
+from metrics import timed
 
 load_dotenv()
 
-account_sid = os.environ["TWILIO_ACCOUNT_SID"]
-auth_token = os.environ["TWILIO_AUTH_TOKEN"]
-twilio = Client(account_sid, auth_token)
-
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY or "replay")
+
+MONITORED_ADDRESS = os.getenv("MONITORED_ADDRESS", "55 2nd St, San Francisco, CA")
+EMERGENCY_NUMBER = os.getenv("EMERGENCY_NUMBER", "+18322693801")
+TWILIO_FROM_NUMBER = os.getenv("TWILIO_FROM_NUMBER", "+19415417971")
+
+# Created on the first call, so importing this module doesn't need Twilio credentials
+_twilio = None
+_twilio_lock = threading.Lock()
+
+
+def get_twilio():
+    global _twilio
+    with _twilio_lock:
+        if _twilio is None:
+            _twilio = Client(os.environ["TWILIO_ACCOUNT_SID"],
+                             os.environ["TWILIO_AUTH_TOKEN"])
+        return _twilio
 
 
 generate_call_prompt = """
@@ -24,7 +43,7 @@ Please generate a call message to send to the emergency services, very briefly s
 the conversation you had with the person who fell. Pretend you are talking to them directly
 on the phone, and only print the text you would say.
 
-The address you are monitoring is 55 2nd St, San Francisco, CA
+The address you are monitoring is {address}
 
 ```conversation
 {history}
@@ -33,32 +52,79 @@ The address you are monitoring is 55 2nd St, San Francisco, CA
 
 
 def generate_call_message(conversation_history):
-    message = client.messages.create(
+    request = dict(
         model="claude-3-5-sonnet-20241022",
         max_tokens=500,
         messages=[
             {"role": "user",
              "content": generate_call_prompt.format(
-                 history=conversation_history)}
+                 history=conversation_history, address=MONITORED_ADDRESS)}
         ]
     )
 
-    return message.content[0].text
+    def fetch():
+        return client.messages.create(**request).content[0].text
+
+    with timed("claude_call", kind="call_message"):
+        return llm_cache.cached(request, fetch)
+
+
+def dispatch_message(situation_summary="", last_reply=None):
+    """
+    Builds the call message from the summary kept up to date during triage, so
+    calling needs no extra LLM round trip. Without a summary it still says enough
+    for a dispatcher to act on.
+    """
+    summary = situation_summary.strip()
+    if not summary:
+        summary = "The person has fallen and may be injured."
+        if last_reply:
+            summary += f' Their last reply was: "{last_reply.strip()}"'
+
+    return (f"This is LifelineAI, an automated fall monitoring service, calling to report a fall at "
+            f"{MONITORED_ADDRESS}. {summary} Please send help to {MONITORED_ADDRESS}.")
 
 
 def make_call(message):
-    call = twilio.calls.create(
-        twiml=f"<Response><Say>{message}</Say></Response>",
-        to="+18322693801",
-        from_="+19415417971",
-    )
+    """Places the call and returns its SID."""
+    with timed("twilio_call"):
+        call = get_twilio().calls.create(
+            twiml=f"<Response><Say>{escape(message)}</Say></Response>",
+            to=EMERGENCY_NUMBER,
+            from_=TWILIO_FROM_NUMBER,
+        )
 
     print(call.sid)
+    return call.sid
+
+
+def dispatch_call(message, attempts=3, retry_delay=1.0):
+    """
+    Places the call on a background thread, retrying failures with backoff.
+    Returns a Future that resolves to the call SID.
+    """
+    future = Future()
+
+    def run():
+        with timed("dispatch"):
+            for attempt in range(attempts):
+                try:
+                    future.set_result(make_call(message))
+                    return
+                except Exception as e:
+                    print(f"Emergency call attempt {attempt + 1} failed: {e}")
+                    if attempt == attempts - 1:
+                        future.set_exception(e)
+                    else:
+                        time.sleep(retry_delay * 2 ** attempt)
+
+    threading.Thread(target=run, name="dispatch", daemon=True).start()
+    return future
 
 
 if __name__ == '__main__':
 
-    message = generate_call_message("My tummy hurty")
+    message = dispatch_message("The person says their tummy hurts.")
     print(message)
 
-    make_call(message)
+    dispatch_call(message).result()
@@ -0,0 +1,570 @@
+"""
+Shared camera capture.
+
+CameraManager owns one CameraWorker per configured source. A worker runs a single
+capture thread and a single VLM inference pipeline for its camera and publishes
+encoded frames on a hub, so any number of browser tabs can watch the same camera
+without opening the device again or paying for inference twice.
+
+Inside a worker the camera is read on its own clock into a latest-frame slot, and
+the browser preview and VLM sampling each take frames from it at their own rate.
+Sources are opened through video_sources, so a worker can also watch a file, an
+image sequence, a network stream or a faster-than-realtime replay.
+"""
+import os
+import platform
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+from broadcast import BroadcastHub
+from frame_codec import INFERENCE_PROFILE, PREVIEW_PROFILE
+from frame_ring import ClipRecorder, FrameRing
+from fusion import CONFIRM, TRIGGER, VerdictFusion
+from metrics import observe, timed
+from motion import MotionDetector, MotionGate
+from rate_control import AdaptiveRateController, FrameScheduler
+from video_sources import open_source
+from vlm_client import SlidingWindow, VLMPipeline
+from vlm_link import get_vlm_connection
+
+load_dotenv()
+
+# external_ws_url = "ws://localhost:8765"
+VLM_URL = os.getenv(
+    "VLM_URL") or "wss://p01--vlm-inference--f6l8w976xnkg.code.run"
+
+# Smallest batch a motion spike may force out before the buffer is full
+MIN_SPIKE_FRAMES = 2
+# Batches that may be waiting on the VLM at once
+VLM_MAX_IN_FLIGHT = 2
+# Fraction of each VLM window shared with the next one
+VLM_WINDOW_OVERLAP = 0.25
+# Browser preview rate, independent of how often frames are sampled for the VLM
+PREVIEW_FPS = float(os.getenv("PREVIEW_FPS", "15"))
+# Camera read rate; 0 uses the source's own frame rate
+CAPTURE_FPS = float(os.getenv("CAPTURE_FPS", "0"))
+# Simulated seconds a replay waits for each VLM reply, whatever the real latency
+REPLAY_VLM_LATENCY = float(os.getenv("REPLAY_VLM_LATENCY", "0.5"))
+# Send the clip around each detected fall back to the VLM for a second look
+CLIP_REANALYZE = os.getenv("CLIP_REANALYZE", "true").lower() in (
+    "1", "true", "yes")
+
+
+def window_hop(buffer_length):
+    """Number of new frames between consecutive VLM windows."""
+    return max(1, round(buffer_length * (1 - VLM_WINDOW_OVERLAP)))
+
+
+def default_camera_source():
+    # Pick the right camera index for macOS vs others
+    return 1 if platform.system() == "Darwin" else 0
+
+
+def parse_camera_sources(spec):
+    """
+    Parses a CAMERA_SOURCES value such as "0", "0,1" or "front=0,hall=rtsp://...".
+    Returns an ordered {camera_id: source} dict; numeric sources become device indices,
+    and everything else is opened by video_sources.open_source().
+    """
+    sources = {}
+    for i, item in enumerate(s.strip() for s in spec.split(",")):
+        if not item:
+            continue
+        camera_id, sep, source = item.partition("=")
+        if not sep or "://" in camera_id:
+            camera_id, source = str(i), item
+        sources[camera_id.strip()] = int(
+            source) if source.strip().isdigit() else source.strip()
+    return sources
+
+
+class LatestFrame:
+    """
+    Hands the newest captured frame to any number of consumers. Each put() replaces
+    the previous frame, so a consumer that wasn't ready for a frame never sees it.
+    In lockstep (for replays), put() instead waits until every named consumer has
+    taken the previous frame, so capture runs exactly as fast as the slowest one.
+    """
+
+    def __init__(self, lockstep=()):
+        self.seq = 0
+        self.frame = None
+        self.ts = None
+        self.closed = False
+        self.taken = {consumer: 0 for consumer in lockstep}
+        self._cond = threading.Condition()
+
+    def put(self, frame, ts):
+        with self._cond:
+            self._cond.wait_for(lambda: self.closed or all(
+                seq >= self.seq for seq in self.taken.values()))
+            self.seq += 1
+            self.frame = frame
+            self.ts = ts
+            self._cond.notify_all()
+
+    def get(self, after=0, timeout=None, consumer=None):
+        """
+        Waits for a frame newer than sequence number after. Returns (seq, frame, ts),
+        or None on timeout or once the slot is closed.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.seq > after or self.closed, timeout)
+            if self.seq > after:
+                if consumer in self.taken:
+                    self.taken[consumer] = self.seq
+                    self._cond.notify_all()
+                return self.seq, self.frame, self.ts
+            return None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class CameraWorker:
+    """Capture thread plus inference pipeline for one camera."""
+
+    def __init__(self, camera_id, source, triage_sessions, fall_detected_hub, frame_update_hub,
+                 debug=lambda: False, rate_controller=None, preview_profile=PREVIEW_PROFILE,
+                 inference_profile=INFERENCE_PROFILE, vlm_url=None, clip_hub=None, clip_handlers=(),
+                 event_store=None, fusion=None, preview_fps=PREVIEW_FPS, replay_speed=None,
+                 replay_latency=REPLAY_VLM_LATENCY):
+        self.camera_id = camera_id
+        self.source = source
+        self.triage_sessions = triage_sessions
+        self.fall_detected_hub = fall_detected_hub
+        self.frame_update_hub = frame_update_hub
+        self.debug = debug
+        self.preview_profile = preview_profile
+        self.inference_profile = inference_profile
+        self.preview_fps = preview_fps
+        # Speed of "replay:" sources; None uses REPLAY_SPEED
+        self.replay_speed = replay_speed
+        self.replay_latency = replay_latency
+        self.video_source = None
+        self.vlm_url = vlm_url or VLM_URL
+        # Shared, long-lived link; connecting now means it's up before anyone watches
+        self.connection = get_vlm_connection(self.vlm_url)
+        self.clip_hub = clip_hub
+        # Optional EventStore that keeps verdicts and detections across restarts
+        self.event_store = event_store
+
+        # Viewers subscribe here; a slow viewer only ever skips frames
+        self.frames = BroadcastHub(
+            f"frames:{camera_id}", buffer_size=2, replay=1)
+
+        # Picks capture rate, batch length and inference resolution
+        self.rate_controller = rate_controller or AdaptiveRateController(
+            max_in_flight=VLM_MAX_IN_FLIGHT, window_overlap=VLM_WINDOW_OVERLAP)
+        self.decision = self.rate_controller.decide(time.time())
+        # Decides from the stream of verdicts when a fall is real enough for triage
+        self.fusion = fusion or VerdictFusion()
+        self._confirm = False
+        self.running = False
+        self.frames_captured = 0
+        # Frames each consumer took from the latest-frame slot, and how many it skipped
+        self.consumers = {
+            "preview": {"frames": 0, "skipped": 0},
+            "inference": {"frames": 0, "skipped": 0},
+        }
+        self._last_preview = (0, None)
+        self.pipeline = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # The last few seconds of preview frames, cut into a clip when a fall is detected
+        self.ring = FrameRing()
+        handlers = list(clip_handlers)
+        if clip_hub is not None:
+            handlers.insert(0, lambda clip: clip_hub.publish(clip.summary()))
+        if CLIP_REANALYZE:
+            handlers.append(self._reanalyze_clip)
+        self.clips = ClipRecorder(camera_id, self.ring, handlers=handlers)
+        # Sequence IDs of re-analysis batches, mapped to their clip
+        self._reanalysis = {}
+
+    def start(self):
+        """Starts the capture thread if it isn't already running."""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(
+                target=self._run, name=f"camera-{self.camera_id}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def status(self):
+        return {
+            "camera_id": self.camera_id,
+            "source": str(self.source),
+            "running": self.running,
+            "rate": self.decision.to_dict(),
+            "person_in_frame": self.rate_controller.person_in_frame,
+            "viewers": self.frames.stats()["subscribers"],
+            "frames_captured": self.frames_captured,
+            "preview_fps": self.preview_fps,
+            "consumers": self.consumers,
+            "ring": self.ring.stats(),
+            "fusion": self.fusion.stats(),
+            "vlm": self.pipeline.stats() if self.pipeline else None,
+            "vlm_link": self.connection.health(),
+        }
+
+    def _run(self):
+        try:
+            self._capture_loop()
+        finally:
+            self.running = False
+
+    def _capture_loop(self):
+        """
+        Opens the camera and reads it continuously into a latest-frame slot. Preview
+        and inference each sample the slot on their own thread and clock: viewers
+        get frames at preview_fps whatever the VLM sampling rate, and a consumer
+        that falls behind skips to the newest frame instead of holding up the others.
+        """
+        try:
+            source = open_source(self.source, self.replay_speed)
+        except (IOError, ValueError) as e:
+            print(f"[Camera {self.camera_id}] Could not open camera: {e}")
+            return
+        self.video_source = source
+
+        # Batches go out on their own thread over the shared VLM link; while the
+        # link is down, capture and preview carry on and no batches are submitted.
+        # Staleness is judged on the source's clock, which a replay runs ahead of time
+        pipeline = VLMPipeline(self.connection, max_in_flight=VLM_MAX_IN_FLIGHT,
+                               frame_clock=source.clock)
+        pipeline.start()
+        self.pipeline = pipeline
+
+        if source.simulated:
+            # A replay runs as fast as its slowest consumer, or at speed x real time
+            scheduler = FrameScheduler(source.fps * source.speed) if source.speed else None
+            slot = LatestFrame(lockstep=self.consumers)
+        else:
+            # Webcams block in read() until the next frame; files are paced to their own rate
+            scheduler = FrameScheduler(CAPTURE_FPS or source.fps or 30)
+            slot = LatestFrame()
+        consumers = [
+            threading.Thread(target=self._consume, args=(self._preview_loop, slot),
+                             name=f"preview-{self.camera_id}", daemon=True),
+            threading.Thread(target=self._consume, args=(self._inference_loop, slot, pipeline),
+                             name=f"inference-{self.camera_id}", daemon=True),
+        ]
+        for consumer in consumers:
+            consumer.start()
+
+        try:
+            while self.running:
+                if scheduler is not None:
+                    scheduler.wait()
+
+                with timed("camera_read", camera=self.camera_id):
+                    captured = source.read()
+                if captured is None:
+                    print(f"[Camera {self.camera_id}] Failed to read frame.")
+                    break
+                self.frames_captured += 1
+                slot.put(*captured)
+
+        except Exception as e:
+            print(f"[Camera {self.camera_id}] Exception during streaming: {e}")
+
+        finally:
+            slot.close()
+            for consumer in consumers:
+                consumer.join()
+            source.close()
+            # Stop the pipeline's sender; the VLM link stays up for next time
+            pipeline.close()
+            print(
+                f"[Camera {self.camera_id}] Camera and external processing threads closed.")
+
+    def _consume(self, loop, slot, *args):
+        """Runs a consumer loop; if it fails, the whole worker stops."""
+        try:
+            loop(slot, *args)
+        except Exception as e:
+            print(f"[Camera {self.camera_id}] Exception in {threading.current_thread().name}: {e}")
+        finally:
+            self.running = False
+            # Don't leave a lockstep capture waiting on this consumer
+            slot.close()
+
+    def _next_frame(self, slot, consumer, last_seq, scheduler):
+        """
+        Waits for consumer's next frame on its scheduler and returns the newest one
+        after last_seq as (seq, frame, ts), or None once capture has stopped. Frames
+        with simulated timestamps are taken one by one and skipped until one is due.
+        """
+        simulated = self.video_source.simulated
+        if not simulated:
+            scheduler.wait()
+        stats = self.consumers[consumer]
+        while self.running:
+            latest = slot.get(after=last_seq, timeout=1.0, consumer=consumer)
+            if latest is None:
+                if slot.closed:
+                    break
+                continue
+            if last_seq:
+                stats["skipped"] += latest[0] - last_seq - 1
+            if simulated and not scheduler.due(latest[2]):
+                stats["skipped"] += 1
+                last_seq = latest[0]
+                continue
+            stats["frames"] += 1
+            return latest
+        return None
+
+    def _preview_loop(self, slot):
+        """Encodes frames for viewers and the clip ring at the preview rate."""
+        scheduler = FrameScheduler(self.preview_fps)
+        seq = 0
+        while True:
+            latest = self._next_frame(slot, "preview", seq, scheduler)
+            if latest is None:
+                return
+            seq, frame, now = latest
+
+            with timed("jpeg_encode", camera=self.camera_id, profile="preview"):
+                jpeg = self.preview_profile.encode(frame)
+            if jpeg is None:
+                print(f"[Camera {self.camera_id}] Failed to encode frame.")
+                return
+            self._last_preview = (seq, jpeg)
+
+            self.frames.publish(jpeg)
+            self.ring.append(jpeg, now)
+
+    def _inference_loop(self, slot, pipeline):
+        """
+        Samples frames at the rate controller's rate into a sliding window whose
+        batches go to the VLM server through the pipelined client.
+        """
+        # Windows overlap so no time span goes unanalyzed
+        decision = self.decision
+        window = SlidingWindow(decision.batch_frames,
+                               window_hop(decision.batch_frames))
+        scheduler = FrameScheduler(decision.framerate)
+
+        # Cheap local change detection decides which batches are worth a VLM call
+        motion_detector = MotionDetector()
+        motion_gate = MotionGate()
+
+        # In a replay each reply is handled a fixed simulated time after its batch,
+        # so a run over the same footage makes the same decisions however fast the
+        # VLM answers. Holds (seq, simulated time the reply is due).
+        simulated = self.video_source.simulated
+        replies_due = deque()
+
+        seq = 0
+        while True:
+            # Sleep until this frame's deadline, net of the previous frame's work
+            latest = self._next_frame(slot, "inference", seq, scheduler)
+            if latest is None:
+                return
+            seq, frame, now = latest
+
+            # Preview and inference have their own encoding profiles; when they
+            # would produce the same JPEG and preview already encoded this frame,
+            # the encode is shared
+            height, width = frame.shape[:2]
+            preview_seq, preview_jpeg = self._last_preview
+            if preview_seq == seq and \
+                    self.inference_profile.same_output(self.preview_profile, width, height, decision.scale):
+                inference_jpeg = preview_jpeg
+            else:
+                with timed("jpeg_encode", camera=self.camera_id, profile="inference"):
+                    inference_jpeg = self.inference_profile.encode(
+                        frame, decision.scale)
+                if inference_jpeg is None:
+                    print(
+                        f"[Camera {self.camera_id}] Failed to encode inference frame.")
+                    return
+
+            # Score how much the scene changed on a small grayscale copy
+            score = motion_detector.update(frame)
+            spike = motion_gate.observe(score, now)
+            self.rate_controller.observe_motion(score, now)
+            self.rate_controller.observe_frame_size(
+                *self.inference_profile.output_size(width, height))
+
+            # Frames are always collected, even while batches are in flight
+            window.push(inference_jpeg, now)
+
+            # Fusion wants a quick second look at a possible fall
+            confirm = self._confirm and window.new_frames >= MIN_SPIKE_FRAMES
+            batch_ready = window.ready() or confirm or (
+                spike and len(window) >= MIN_SPIKE_FRAMES)
+            if simulated:
+                has_capacity = pipeline.connected and len(replies_due) < pipeline.max_in_flight
+            else:
+                has_capacity = pipeline.has_capacity()
+            if batch_ready and has_capacity:
+                if confirm or motion_gate.should_send(now, self.rate_controller.person_in_frame):
+                    # A confirmation only needs the frames the VLM hasn't seen
+                    frames, timestamps = window.take(
+                        window.new_frames if confirm else None)
+                    batch_seq = pipeline.submit(frames, timestamps)
+                    if simulated and batch_seq is not None:
+                        replies_due.append((batch_seq, now + self.replay_latency))
+                    motion_gate.sent(now)
+                    self._confirm = False
+                else:
+                    # Scene is static: let this window pass without a VLM call
+                    motion_gate.skipped()
+                    window.skip()
+
+            # Handle any responses that came back, oldest batch first
+            if simulated:
+                self._handle_due_replies(pipeline, replies_due, now)
+            else:
+                for result in pipeline.poll():
+                    self._handle_result(result, now)
+
+            # Adapt sampling rate, batch length and resolution
+            new_decision = self.rate_controller.decide(now)
+            if new_decision != decision:
+                decision = self._apply_decision(
+                    new_decision, window, scheduler)
+
+    def _handle_due_replies(self, pipeline, replies_due, now, poll_interval=0.002):
+        """Replay only: handles every reply due by now, holding the footage until each arrives."""
+        while replies_due and replies_due[0][1] <= now and self.running:
+            batch_seq, due = replies_due[0]
+            # Checked before polling, so a settled batch is delivered by this poll;
+            # polling every pass lets it give up on a lost reply as in live mode
+            settled = pipeline.settled(batch_seq)
+            for result in pipeline.poll(through=batch_seq):
+                # Round trips are simulated too, so the rate controller sees the same ones
+                result.round_trip = due - result.end_ts
+                self._handle_result(result, due)
+            if settled:
+                replies_due.popleft()
+            else:
+                time.sleep(poll_interval)
+
+    def _apply_decision(self, decision, window, scheduler):
+        scheduler.set_rate(decision.framerate)
+        window.resize(decision.batch_frames,
+                      window_hop(decision.batch_frames))
+        self.decision = decision
+
+        # Dashboards show rate changes as they happen
+        update = decision.to_dict()
+        update["camera_id"] = self.camera_id
+        if self.rate_controller.round_trip is not None:
+            update["round_trip"] = round(self.rate_controller.round_trip, 3)
+        self.frame_update_hub.publish(update)
+        return decision
+
+    def _handle_result(self, result, now):
+        response = result.response
+        print(
+            f"[Camera {self.camera_id}] Server response for batch {result.seq} ({result.round_trip:.2f}s): {response}")
+
+        with self._lock:
+            clip_id = self._reanalysis.pop(result.seq, None)
+        # Second looks at clips are reported, not fused into the live stream
+        verdict = None if clip_id is not None else self.fusion.observe(
+            response, result.end_ts)
+        if self.event_store is not None:
+            self.event_store.put("vlm_verdict", {
+                "seq": result.seq,
+                "start_ts": result.start_ts,
+                "frames": result.num_frames,
+                "round_trip": result.round_trip,
+                "clip_id": clip_id,
+                "response": response,
+                "fusion": verdict.to_dict() if verdict else None,
+            }, camera_id=self.camera_id, ts=result.end_ts)
+
+        if clip_id is not None:
+            # A second look at a clip doesn't start another session
+            if self.clip_hub is not None:
+                self.clip_hub.publish({"clip_id": clip_id, "camera_id": self.camera_id,
+                                       "reanalysis": response})
+        elif verdict.action == TRIGGER or self.debug():
+            # Repeat falls are dropped while a session is active
+            if self.triage_sessions.start(self.camera_id):
+                event = {
+                    "fall_detected": "FALL DETECTED",
+                    "camera_id": self.camera_id,
+                    "timestamp": result.end_ts,
+                    # When the alert went out, on the same clock as timestamp
+                    "detected_at": now,
+                    "score": verdict.score,
+                }
+                self.fall_detected_hub.publish(event)
+                if self.event_store is not None:
+                    self.event_store.put("fall_detected", event, camera_id=self.camera_id,
+                                         session_id=self.triage_sessions.session_id,
+                                         ts=result.end_ts)
+                self.clips.request(result.end_ts, seq=result.seq)
+        elif verdict.action == CONFIRM:
+            print(f"[Camera {self.camera_id}] Possible fall (score {verdict.score}), confirming.")
+            self._confirm = True
+
+        observe("vlm_round_trip", result.round_trip, camera=self.camera_id)
+
+        # Feed the rate controller; the next decision picks this up
+        self.rate_controller.observe_round_trip(result.round_trip)
+        self.rate_controller.observe_response(response, now)
+
+    def _reanalyze_clip(self, clip, attempts=20):
+        """Sends evenly spaced frames from the clip to the VLM, on the clip thread."""
+        pipeline = self.pipeline
+        if pipeline is None:
+            return
+        if self.video_source is not None and self.video_source.simulated:
+            # Second looks go out on this thread's wall clock, which would make a
+            # replay's decisions depend on timing
+            return
+        count = min(len(clip.frames), max(self.decision.batch_frames, 2))
+        picks = [round(i * (len(clip.frames) - 1) / max(count - 1, 1))
+                 for i in range(count)]
+
+        for _ in range(attempts):
+            with self._lock:
+                seq = pipeline.submit([clip.frames[i] for i in picks],
+                                      [clip.timestamps[i] for i in picks])
+                if seq is not None:
+                    self._reanalysis[seq] = clip.clip_id
+                    return
+            # Live batches come first; wait for a free slot
+            time.sleep(0.25)
+        print(f"[Camera {self.camera_id}] VLM busy, clip {clip.clip_id} not re-analyzed.")
+
+
+class CameraManager:
+    """Creates one worker per configured camera and starts it when first needed."""
+
+    def __init__(self, sources, **worker_kwargs):
+        self.workers = {
+            camera_id: CameraWorker(camera_id, source, **worker_kwargs)
+            for camera_id, source in sources.items()
+        }
+
+    @property
+    def default_camera_id(self):
+        return next(iter(self.workers), None)
+
+    def get(self, camera_id=None):
+        """Returns the running worker for camera_id (or the first camera), or None if unknown."""
+        worker = self.workers.get(camera_id or self.default_camera_id)
+        if worker is not None:
+            worker.start()
+        return worker
+
+    def status(self):
+        return [worker.status() for worker in self.workers.values()]
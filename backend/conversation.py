@@ -0,0 +1,143 @@
+"""
+Conversation state for the triage agent.
+
+The system prompt is sent once per call as a cacheable system block, instead of
+also riding along as a "system" message in the history. The message list is kept
+within a token budget: when it grows past it, the oldest exchanges are folded into a
+short summary attached to the opening message, while the most recent turns are
+always sent verbatim. The last message carries a cache breakpoint too, so each turn
+can reuse the previous turn's prefix from the prompt cache.
+
+Note that Anthropic only caches prefixes above a minimum length (1024 tokens for
+Sonnet), so caching kicks in once the tools, system prompt and history reach it.
+"""
+import threading
+import time
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Stands in for the person's turn when they didn't reply
+NO_RESPONSE = "(No response detected)"
+
+TOKEN_KINDS = ("input_tokens", "output_tokens",
+               "cache_creation_input_tokens", "cache_read_input_tokens")
+
+# Process-wide totals across all conversations, for /metrics
+token_totals = dict.fromkeys(TOKEN_KINDS, 0)
+_totals_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+class ConversationState:
+    def __init__(self, system_prompt, opening_message, token_budget=2000, keep_recent=6):
+        self.system_prompt = system_prompt
+        self.opening_message = opening_message
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.turns = [{"role": "user", "content": opening_message}]
+        self.usage = []
+        # Kept current every turn so an emergency call can be placed without another LLM call
+        self.situation_summary = ""
+
+    def add_user(self, text):
+        self.turns.append({"role": "user", "content": text})
+
+    def add_assistant(self, text):
+        self.turns.append({"role": "assistant", "content": text})
+
+    def update_summary(self, summary):
+        if summary and summary.strip():
+            self.situation_summary = summary.strip()
+
+    def last_user_reply(self):
+        """The person's most recent reply, or None if they haven't said anything."""
+        for turn in reversed(self.turns[1:]):
+            if turn["role"] == "user" and turn["content"] != NO_RESPONSE:
+                return turn["content"]
+        return None
+
+    def system(self, extra=None):
+        """System blocks: the prompt as a cached prefix, then any per-call extra text."""
+        blocks = [{"type": "text", "text": self.system_prompt,
+                   "cache_control": CACHE_CONTROL}]
+        if extra:
+            blocks.append({"type": "text", "text": extra})
+        return blocks
+
+    def messages(self):
+        """The messages to send this turn, trimmed to the token budget."""
+        turns = list(self.turns)
+        dropped = []
+
+        # Drop whole (assistant, user) exchanges after the opening message so roles
+        # still alternate, but always keep the most recent turns
+        while (self._tokens(turns) > self.token_budget
+               and len(turns) - 1 > self.keep_recent and len(turns) >= 3):
+            dropped.extend(turns[1:3])
+            del turns[1:3]
+
+        messages = [dict(m) for m in turns]
+        if dropped:
+            messages[0]["content"] = self.opening_message + \
+                "\n\n" + self._summary(dropped)
+
+        last = messages[-1]
+        last["content"] = [{"type": "text", "text": last["content"],
+                            "cache_control": CACHE_CONTROL}]
+        return messages
+
+    def transcript(self):
+        """The full, untrimmed conversation as readable text."""
+        names = {"user": "Person", "assistant": "AI"}
+        return "\n".join(f"{names[t['role']]}: {t['content']}" for t in self.turns[1:])
+
+    def record_usage(self, usage, estimated=False):
+        """Stores token usage for one turn (an Anthropic Usage object or a dict) and returns it."""
+        if not isinstance(usage, dict):
+            usage = {
+                "input_tokens": usage.input_tokens,
+                "output_tokens": usage.output_tokens,
+                "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+                "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+            }
+        usage = dict(usage, turn=len(self.usage) + 1,
+                     estimated=estimated, time=time.time())
+        self.usage.append(usage)
+        with _totals_lock:
+            for kind in TOKEN_KINDS:
+                token_totals[kind] += usage.get(kind, 0)
+        print(f"DEBUG - Tokens: Prompt: {usage['input_tokens']}, Completion: {usage['output_tokens']}, "
+              f"Cache Read: {usage.get('cache_read_input_tokens', 0)}, "
+              f"Cache Write: {usage.get('cache_creation_input_tokens', 0)}"
+              f"{' (estimated)' if estimated else ''}")
+        return usage
+
+    def estimate_usage(self, completion_text, extra_system=""):
+        """Records an estimate when the API usage isn't available (e.g. streamed calls)."""
+        prompt = self.system_prompt + (extra_system or "") + \
+            "".join(str(m["content"]) for m in self.messages())
+        return self.record_usage({
+            "input_tokens": estimate_tokens(prompt),
+            "output_tokens": estimate_tokens(completion_text),
+        }, estimated=True)
+
+    def _tokens(self, turns):
+        return sum(estimate_tokens(t["content"]) + 4 for t in turns)
+
+    @staticmethod
+    def _summary(dropped, max_chars=80, max_lines=8):
+        lines = []
+        if len(dropped) > max_lines:
+            lines.append(f"- ({len(dropped) - max_lines} earlier turns omitted)")
+            dropped = dropped[-max_lines:]
+        for turn in dropped:
+            speaker = "AI asked" if turn["role"] == "assistant" else "Person said"
+            text = turn["content"]
+            if len(text) > max_chars:
+                text = text[:max_chars].rstrip() + "..."
+            lines.append(f"- {speaker}: {text}")
+        return "(Summary of earlier turns:\n" + "\n".join(lines) + ")"
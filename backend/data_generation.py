@@ -1,7 +1,12 @@
 import anthropic
+import argparse
+import llm_cache
 import json
 import csv
+import glob
 import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 import time
 
@@ -11,11 +16,11 @@ load_dotenv()
 # Get API key from environment variables
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-if not ANTHROPIC_API_KEY:
+if not ANTHROPIC_API_KEY and not llm_cache.replaying():
     raise ValueError("Missing Anthropic API key! Please set it in .env file.")
 
 # Initialize Anthropic client
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY or "replay")
 
 # Read prompt template from file
 with open("datagen_prompt.txt", "r") as file:
@@ -24,23 +29,26 @@ with open("datagen_prompt.txt", "r") as file:
 # Define number of total conversations to generate
 TARGET_CONVERSATIONS = 100
 CONVERSATIONS_PER_BATCH = 10
-NUM_BATCHES = (TARGET_CONVERSATIONS + CONVERSATIONS_PER_BATCH - 1) // CONVERSATIONS_PER_BATCH  # Ceiling division
+# Batches per JSONL shard file
+BATCHES_PER_SHARD = 100
 
-# Function to generate multiple triage cases at once
-def generate_triage_batch():
-    response = client.messages.create(
+# Every batch sends the same request, so the variant (batch and attempt) keeps
+# each one a separate entry in the LLM cache
+def generate_triage_batch(variant=None, per_batch=CONVERSATIONS_PER_BATCH):
+    request = dict(
         model="claude-3-7-sonnet-20250219",
         max_tokens=4000,  # Increased for batch generation
         temperature=0.8,
         system=SYSTEM_PROMPT,
         messages=[
-            {"role": "user", "content": f"Generate exactly {CONVERSATIONS_PER_BATCH} different triage conversations in valid JSON array format as specified."}
+            {"role": "user", "content": f"Generate exactly {per_batch} different triage conversations in valid JSON array format as specified."}
         ]
     )
-    
+
     # Extract text content
-    content = response.content[0].text
-    
+    content = llm_cache.cached(
+        request, lambda: client.messages.create(**request).content[0].text, variant=variant)
+
     # Try to parse JSON
     try:
         # First try direct parsing
@@ -56,75 +64,175 @@ def generate_triage_batch():
         # If still no success, raise the error
         raise
 
-# Generate dataset
-all_data = []
-for i in range(NUM_BATCHES):
-    print(f"Generating batch {i+1}/{NUM_BATCHES} (conversations {i*CONVERSATIONS_PER_BATCH+1}-{min((i+1)*CONVERSATIONS_PER_BATCH, TARGET_CONVERSATIONS)})...")
-    
-    max_retries = 3
+
+def generate_validated_batch(i, per_batch=CONVERSATIONS_PER_BATCH, max_retries=3):
+    """Generates batch i, retrying bad responses. Returns its conversations, or None if every attempt failed."""
     for attempt in range(max_retries):
         try:
-            batch_data = generate_triage_batch()
-            
+            batch_data = generate_triage_batch(variant=[i, attempt], per_batch=per_batch)
+
             # Validate that we got enough conversations
             if not isinstance(batch_data, list):
-                print(f"⚠️ Warning: Expected list but got {type(batch_data)}. Retrying...")
+                print(f"⚠️ Warning: Expected list but got {type(batch_data)} for batch {i+1}. Retrying...")
                 continue
-                
-            if len(batch_data) < CONVERSATIONS_PER_BATCH:
-                print(f"⚠️ Warning: Only received {len(batch_data)} conversations instead of {CONVERSATIONS_PER_BATCH}. Retrying...")
+
+            if len(batch_data) < per_batch:
+                print(f"⚠️ Warning: Only received {len(batch_data)} conversations instead of {per_batch} for batch {i+1}. Retrying...")
                 continue
-                
-            all_data.extend(batch_data[:CONVERSATIONS_PER_BATCH])  # Only take the requested number
-            print(f"✓ Successfully generated batch {i+1} with {len(batch_data[:CONVERSATIONS_PER_BATCH])} conversations")
-            break
-            
+
+            return batch_data[:per_batch]  # Only take the requested number
+
         except json.JSONDecodeError as e:
             print(f"❌ Error parsing JSON for batch {i+1}, attempt {attempt+1}: {e}")
-            if attempt == max_retries - 1:
-                print("All retries failed. Moving to next batch.")
-            else:
-                print("Retrying...")
-                time.sleep(2)  # Brief pause before retry
-                
+        except llm_cache.CacheMiss:
+            # A replay must fail loudly rather than carry on with missing batches
+            raise
         except Exception as e:
             print(f"❌ Unexpected error for batch {i+1}, attempt {attempt+1}: {e}")
-            if attempt == max_retries - 1:
-                print("All retries failed. Moving to next batch.")
-            else:
-                print("Retrying...")
-                time.sleep(2)  # Brief pause before retry
-
-# Trim to target size if we got more conversations than needed
-if len(all_data) > TARGET_CONVERSATIONS:
-    all_data = all_data[:TARGET_CONVERSATIONS]
-
-# Save to JSON
-json_filename = "triage_synthetic_data.json"
-with open(json_filename, "w") as json_file:
-    json.dump(all_data, json_file, indent=4)
-
-# Save to CSV
-csv_filename = "triage_synthetic_data.csv"
-with open(csv_filename, "w", newline="") as csv_file:
-    fieldnames = ["situation_context", "conversation_log", "final_decision", "total_score"]
-    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-    
-    writer.writeheader()
-    for entry in all_data:
-        try:
-            # Extract total score from the nested structure
-            total_score = entry["Trajectory Efficiency Score"]["Total Score"] if isinstance(entry["Trajectory Efficiency Score"], dict) else "N/A"
-                
-            writer.writerow({
-                "situation_context": entry["Situation Context"],
-                "conversation_log": entry["Conversation Log"],
-                "final_decision": entry["Final Triage Decision"],
-                "total_score": total_score
-            })
-        except KeyError as e:
-            print(f"Missing expected key in data: {e}")
-            print(f"Entry structure: {entry.keys() if isinstance(entry, dict) else type(entry)}")
-
-print(f"✅ Data generation complete! Generated {len(all_data)} valid conversations.")
-print(f"JSON saved to {json_filename}, CSV saved to {csv_filename}.")
\ No newline at end of file
+
+        if attempt < max_retries - 1:
+            print("Retrying...")
+            time.sleep(2)  # Brief pause before retry
+
+    print(f"All retries failed for batch {i+1}.")
+    return None
+
+
+class ShardWriter:
+    """
+    Appends each finished batch to a JSONL shard as one line, {"batch": i, "conversations": [...]}.
+    A line is only complete once its batch is, so the shards double as the checkpoint:
+    on resume, batches already in them are skipped and a torn last line is dropped.
+    """
+
+    def __init__(self, directory, batches_per_shard=BATCHES_PER_SHARD):
+        self.directory = directory
+        self.batches_per_shard = batches_per_shard
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def shards(self):
+        return sorted(glob.glob(os.path.join(self.directory, "shard-*.jsonl")))
+
+    def completed(self):
+        """Batch numbers already written, repairing any line cut off by a crash."""
+        done = set()
+        for path in self.shards():
+            valid_bytes = 0
+            with open(path, "rb") as file:
+                for line in file:
+                    try:
+                        done.add(json.loads(line)["batch"])
+                    except (ValueError, KeyError):
+                        break
+                    valid_bytes += len(line)
+            if valid_bytes < os.path.getsize(path):
+                print(f"Dropping incomplete record at the end of {path}")
+                with open(path, "r+b") as file:
+                    file.truncate(valid_bytes)
+        return done
+
+    def write(self, i, conversations):
+        line = json.dumps({"batch": i, "conversations": conversations}) + "\n"
+        path = os.path.join(self.directory, f"shard-{i // self.batches_per_shard:05d}.jsonl")
+        with self._lock:
+            with open(path, "a", encoding="utf8") as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def conversations(self):
+        """Yields every conversation from the shards, one batch in memory at a time."""
+        for path in self.shards():
+            with open(path, "r", encoding="utf8") as file:
+                for line in file:
+                    yield from json.loads(line)["conversations"]
+
+
+def generate(writer, target=TARGET_CONVERSATIONS, per_batch=CONVERSATIONS_PER_BATCH, workers=4):
+    """Generates the batches missing from writer's shards, several at a time."""
+    num_batches = (target + per_batch - 1) // per_batch  # Ceiling division
+    done = writer.completed()
+    pending = iter([i for i in range(num_batches) if i not in done])
+    print(f"{len(done)} of {num_batches} batches already generated, {num_batches - len(done)} to go.")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Keep only a few batches queued ahead, so memory doesn't grow with the target
+        running = {}
+        while True:
+            for i in pending:
+                running[pool.submit(generate_validated_batch, i, per_batch)] = i
+                if len(running) >= workers * 2:
+                    break
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                batch_data = future.result()
+                if batch_data is None:
+                    failed += 1
+                    continue
+                writer.write(i, batch_data)
+                print(f"✓ Successfully generated batch {i+1}/{num_batches} with {len(batch_data)} conversations")
+
+    return failed
+
+
+def export(writer, json_filename, csv_filename, target=TARGET_CONVERSATIONS):
+    """Streams the shards into the JSON and CSV files, stopping at target conversations."""
+    count = 0
+    with open(json_filename, "w") as json_file, open(csv_filename, "w", newline="") as csv_file:
+        fieldnames = ["situation_context", "conversation_log", "final_decision", "total_score"]
+        csv_writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+        csv_writer.writeheader()
+
+        json_file.write("[")
+        for entry in writer.conversations():
+            # Trim to target size if we got more conversations than needed
+            if count >= target:
+                break
+
+            json_file.write(",\n" if count else "\n")
+            json_file.write("    " + json.dumps(entry, indent=4).replace("\n", "\n    "))
+            count += 1
+
+            try:
+                # Extract total score from the nested structure
+                total_score = entry["Trajectory Efficiency Score"]["Total Score"] if isinstance(entry["Trajectory Efficiency Score"], dict) else "N/A"
+
+                csv_writer.writerow({
+                    "situation_context": entry["Situation Context"],
+                    "conversation_log": entry["Conversation Log"],
+                    "final_decision": entry["Final Triage Decision"],
+                    "total_score": total_score
+                })
+            except KeyError as e:
+                print(f"Missing expected key in data: {e}")
+                print(f"Entry structure: {entry.keys() if isinstance(entry, dict) else type(entry)}")
+        json_file.write("\n]" if count else "]")
+
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic triage conversations.")
+    parser.add_argument("--target", type=int, default=TARGET_CONVERSATIONS, help="Conversations to generate")
+    parser.add_argument("--per-batch", type=int, default=CONVERSATIONS_PER_BATCH, help="Conversations per request")
+    parser.add_argument("--workers", type=int, default=4, help="Batches to generate at once")
+    parser.add_argument("--shards", default="triage_synthetic_data_shards",
+                        help="Directory for the JSONL shards; an interrupted run resumes from it")
+    parser.add_argument("--json", default="triage_synthetic_data.json")
+    parser.add_argument("--csv", default="triage_synthetic_data.csv")
+    args = parser.parse_args()
+
+    writer = ShardWriter(args.shards)
+    failed = generate(writer, args.target, args.per_batch, args.workers)
+    if failed:
+        print(f"⚠️ {failed} batches failed; run again to retry them.")
+
+    count = export(writer, args.json, args.csv, args.target)
+    print(f"✅ Data generation complete! Generated {count} valid conversations.")
+    print(f"JSON saved to {args.json}, CSV saved to {args.csv}.")
@@ -1,20 +1,28 @@
 import anthropic
+import argparse
 import os
 import json
+import random
+import threading
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from pydantic import BaseModel
 import instructor
+import llm_cache
+from metrics import percentile
 
 # Load environment variables
 load_dotenv()
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-if not ANTHROPIC_API_KEY:
+if not ANTHROPIC_API_KEY and not llm_cache.replaying():
     raise ValueError("Missing Anthropic API key! Please set it in .env file.")
 
-# Initialize Anthropic Client with Instructor
-client = instructor.from_anthropic(anthropic.Anthropic(api_key=ANTHROPIC_API_KEY))
+# Initialize Anthropic Client with Instructor. Retries are handled by call_with_retry
+# below, so every worker backs off together when the API rate limits us
+client = instructor.from_anthropic(anthropic.Anthropic(api_key=ANTHROPIC_API_KEY or "replay", max_retries=0))
 
 # Read the system prompt from file
 with open("prime_triage_prompt.txt", "r") as file:
@@ -24,6 +32,12 @@ with open("prime_triage_prompt.txt", "r") as file:
 with open("patients.json", "r") as file:
     patient_profiles = json.load(file)
 
+# Conversations still going after this many AI turns are scored as "no_decision"
+MAX_TURNS = int(os.getenv("EVAL_MAX_TURNS", "10"))
+MAX_ATTEMPTS = 5
+# Status codes worth retrying: rate limited, overloaded, and transient server errors
+RETRY_STATUS = {429, 500, 502, 503, 504, 529}
+
 # Define Structured Response Model
 class TriageResponse(BaseModel):
     reasoning: str
@@ -40,10 +54,122 @@ class TriageResponse(BaseModel):
 class PatientSimulator(BaseModel):
     response_text: str
 
+
+class CallStats:
+    """Latency and retry counts for every API call, shared by all eval workers."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.retries = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def failed(self):
+        with self._lock:
+            self.errors += 1
+
+    def summary(self):
+        with self._lock:
+            kinds = dict(self.latencies)
+            kinds["all"] = [s for values in self.latencies.values() for s in values]
+            return {
+                "latency_seconds": {kind: {
+                    "count": len(values),
+                    "p50": percentile(values, 50),
+                    "p90": percentile(values, 90),
+                    "p99": percentile(values, 99),
+                    "max": max(values) if values else None,
+                } for kind, values in kinds.items()},
+                "retries": self.retries,
+                "errors": self.errors,
+            }
+
+
+class RateLimitGate:
+    """Once any worker is rate limited, holds every worker until the limit clears."""
+
+    def __init__(self):
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self.resume_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.resume_at = max(self.resume_at, time.time() + seconds)
+
+
+call_stats = CallStats()
+rate_limit_gate = RateLimitGate()
+
+
+def api_error(e):
+    """Finds the underlying Anthropic API error, which instructor may have wrapped."""
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        if isinstance(e, (anthropic.APIStatusError, anthropic.APIConnectionError)):
+            return e
+        e = e.__cause__ or e.__context__
+    return None
+
+
+def retry_delay(e, attempt):
+    """Seconds to wait before retrying, or None if e isn't worth retrying."""
+    error = api_error(e)
+    if error is None:
+        return None
+    if isinstance(error, anthropic.APIStatusError):
+        if error.status_code not in RETRY_STATUS:
+            return None
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    # Exponential backoff with jitter
+    return min(30, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def call_with_retry(kind, create):
+    """Calls create() with rate-limit-aware retries, recording latency per attempt."""
+    for attempt in range(MAX_ATTEMPTS):
+        rate_limit_gate.wait()
+        start = time.perf_counter()
+        try:
+            response = create()
+            call_stats.record(kind, time.perf_counter() - start)
+            return response
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt == MAX_ATTEMPTS - 1:
+                call_stats.failed()
+                raise
+            call_stats.retried()
+            print(f"{kind} call failed ({e}), retrying in {delay:.1f}s")
+            error = api_error(e)
+            if isinstance(error, anthropic.APIStatusError) and error.status_code == 429:
+                rate_limit_gate.pause(delay)
+            else:
+                time.sleep(delay)
+
 # Function to simulate patient response based on profile
 def simulate_patient_response(conversation_history, patient_profile):
     """Generates AI-driven patient responses based on the patient profile."""
-    
+
     system_prompt = f"""
     You are simulating a patient in an emergency triage situation.
     - Context: {patient_profile['context']}
@@ -51,29 +177,36 @@ def simulate_patient_response(conversation_history, patient_profile):
     - The correct triage decision is: {patient_profile['right_action']}
     - Your injury severity is: {patient_profile['severity']}
     - Your response clarity is: {patient_profile['response_clarity']}
-    
+
     Given the last message from the AI, respond naturally as a patient would.
     """
 
+    request = dict(
+        model="claude-3-5-sonnet-20241022",
+        max_tokens=100,
+        temperature=0.7,
+        system=system_prompt,
+        messages=conversation_history
+    )
+
     try:
-        response = client.chat.completions.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=100,
-            temperature=0.7,
-            system=system_prompt,
-            messages=conversation_history,
-            response_model=PatientSimulator
-        )
+        response = llm_cache.cached(request, lambda: call_with_retry(
+            "patient", lambda: client.chat.completions.create(**request, response_model=PatientSimulator)
+        ), PatientSimulator)
 
         return response.response_text
 
+    except llm_cache.CacheMiss:
+        # A replay must fail loudly rather than carry on with a made-up reply
+        raise
     except Exception as e:
         print(f"Patient Simulation Error: {e}")
         return "I... I'm not sure..."  # Default fallback response
 
-def triaging_agent(patient_profile):
-    """Handles AI-to-AI triage evaluation."""
-    
+def triaging_agent(patient_profile, max_turns=MAX_TURNS):
+    """Handles AI-to-AI triage evaluation and returns the evaluation result."""
+
+    tag = f"[Patient {patient_profile['id']}]"
     print(f"\n🚀 Evaluating Patient {patient_profile['id']} - {patient_profile['context']}\n")
 
     conversation_history = [
@@ -81,9 +214,7 @@ def triaging_agent(patient_profile):
         {"role": "user", "content": "A possible fall has been detected. Are you okay?"}
     ]
 
-    print(f"👤 **Patient Context:** {patient_profile['context']}")
-    print(f"🏥 **Expected Outcome:** {patient_profile['right_action'].upper()}")
-    print("\n🔄 **Starting Triage Conversation**\n")
+    print(f"{tag} 🏥 **Expected Outcome:** {patient_profile['right_action'].upper()}")
 
     turn_count = 0  # Track number of conversation turns
 
@@ -94,22 +225,25 @@ def triaging_agent(patient_profile):
         response = call_claude(conversation_history)
 
         # Log AI response
-        print(f"🤖 **AI Agent:** {response.response_text}")
+        print(f"{tag} 🤖 **AI Agent:** {response.response_text}")
 
         # Add AI's response to conversation history
         conversation_history.append({"role": "assistant", "content": response.response_text})
 
         # **Exit if AI determines the conversation is complete**
         if response.exit_conversation:
-            print("\nClaude: Triage complete. Ending session.")
-            evaluate_triage(response.final_decision, turn_count, patient_profile)
-            break
+            print(f"\n{tag} Claude: Triage complete. Ending session.")
+            return evaluate_triage(response.final_decision, turn_count, patient_profile)
+
+        if turn_count >= max_turns:
+            print(f"\n{tag} No decision after {turn_count} turns. Ending session.")
+            return evaluate_triage("no_decision", turn_count, patient_profile)
 
         # Simulate Patient Response
         patient_response = simulate_patient_response(conversation_history, patient_profile)
 
         # Log Patient Response
-        print(f"👤 **Patient:** {patient_response}")
+        print(f"{tag} 👤 **Patient:** {patient_response}")
 
         # Add Patient Response to conversation history
         conversation_history.append({"role": "user", "content": patient_response})
@@ -117,19 +251,25 @@ def triaging_agent(patient_profile):
 # Function to call Claude API with structured response
 def call_claude(conversation_history):
     """Send conversation history to Claude and get a structured response."""
-    
+
+    request = dict(
+        model="claude-3-5-sonnet-20241022",
+        max_tokens=300,
+        temperature=0.5,
+        system=SYSTEM_PROMPT,
+        messages=conversation_history
+    )
+
     try:
-        response = client.chat.completions.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=300,
-            temperature=0.5,
-            system=SYSTEM_PROMPT,
-            messages=conversation_history,
-            response_model=TriageResponse
-        )
+        response = llm_cache.cached(request, lambda: call_with_retry(
+            "triage", lambda: client.chat.completions.create(**request, response_model=TriageResponse)
+        ), TriageResponse)
 
         return response
 
+    except llm_cache.CacheMiss:
+        # A replay must fail loudly rather than carry on with a made-up reply
+        raise
     except Exception as e:
         print(f"Claude API Error: {e}")
         return TriageResponse(
@@ -147,11 +287,11 @@ def call_claude(conversation_history):
 # Evaluation Function
 def evaluate_triage(final_decision, turn_count, patient_profile):
     """Compares Claude's final decision against the correct triage decision."""
-    
+
     correct_action = patient_profile["right_action"]
     correct_decision = final_decision == correct_action
 
-    print("\n🚀 TRIAGE EVALUATION 🚀")
+    print(f"\n🚀 TRIAGE EVALUATION (Patient {patient_profile['id']}) 🚀")
     print(f"- Patient actually fell? {patient_profile['actually_fell']}")
     print(f"- Correct triage decision: {correct_action}")
     print(f"- AI's decision: {final_decision}")
@@ -159,7 +299,84 @@ def evaluate_triage(final_decision, turn_count, patient_profile):
     print(f"- Number of conversation turns: {turn_count}")
     print("\n")
 
+    return {
+        "id": patient_profile["id"],
+        "expected": correct_action,
+        "decision": final_decision,
+        "correct": correct_decision,
+        "turns": turn_count,
+        # Called emergency services when it shouldn't have
+        "false_alert": final_decision == "alert_emergency" and correct_action != "alert_emergency",
+        # Didn't call when it should have
+        "miss": correct_action == "alert_emergency" and final_decision != "alert_emergency",
+    }
+
+
+def run_eval(patients, concurrency=4, max_turns=MAX_TURNS):
+    """Evaluates every patient with up to `concurrency` conversations at once."""
+    start = time.time()
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(triaging_agent, patient, max_turns): patient for patient in patients}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                patient = futures[future]
+                print(f"Evaluation of patient {patient['id']} failed: {e}")
+                results.append({"id": patient["id"], "expected": patient["right_action"],
+                                "decision": "error", "correct": False, "turns": 0,
+                                "false_alert": False,
+                                "miss": patient["right_action"] == "alert_emergency",
+                                "error": str(e),
+                                "cache_miss": isinstance(e, llm_cache.CacheMiss)})
+    results.sort(key=lambda r: r["id"])
+
+    positives = [r for r in results if r["expected"] == "alert_emergency"]
+    negatives = [r for r in results if r["expected"] != "alert_emergency"]
+    turns = [r["turns"] for r in results if r["decision"] != "error"]
+
+    def rate(count, total):
+        return count / total if total else None
+
+    return {
+        "patients": len(results),
+        "concurrency": concurrency,
+        "max_turns": max_turns,
+        "wall_seconds": time.time() - start,
+        "accuracy": rate(sum(r["correct"] for r in results), len(results)),
+        "false_alert_rate": rate(sum(r["false_alert"] for r in negatives), len(negatives)),
+        "miss_rate": rate(sum(r["miss"] for r in positives), len(positives)),
+        "no_decision": sum(r["decision"] == "no_decision" for r in results),
+        # Replayed conversations that asked for a response that was never recorded
+        "cache_misses": sum(r.get("cache_miss", False) for r in results),
+        "turns_to_decision": {
+            "mean": sum(turns) / len(turns) if turns else None,
+            "p50": percentile(turns, 50),
+            "p90": percentile(turns, 90),
+            "max": max(turns) if turns else None,
+        },
+        **call_stats.summary(),
+        "llm_cache": llm_cache.cache.stats(),
+        "results": results,
+    }
+
 # Run evaluation on all patients
 if __name__ == "__main__":
-    for patient in patient_profiles:
-        triaging_agent(patient)
+    parser = argparse.ArgumentParser(description="Evaluate the triage agent against simulated patients.")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("EVAL_CONCURRENCY", "4")),
+                        help="Conversations to run at once")
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS)
+    parser.add_argument("--output", default="eval_report.json", help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    report = run_eval(patient_profiles, args.concurrency, args.max_turns)
+    with open(args.output, "w", encoding="utf8") as file:
+        json.dump(report, file, indent=2)
+
+    print(f"Accuracy: {report['accuracy']}, false alert rate: {report['false_alert_rate']}, "
+          f"miss rate: {report['miss_rate']}, wall time: {report['wall_seconds']:.1f}s")
+    print(f"Report written to {args.output}")
+    if report["cache_misses"]:
+        sys.exit(f"{report['cache_misses']} conversations hit responses missing from the LLM cache; "
+                 "record them again (LLM_CACHE=record).")
@@ -0,0 +1,149 @@
+"""
+Persistent history of fall detections, VLM verdicts, clips and triage transcripts.
+
+Events go into an append-only SQLite table in WAL mode, indexed by camera, type,
+session and time. put() never blocks: it drops the event onto a bounded queue, and
+one writer thread commits whatever has queued up in a single transaction, so a
+burst of events costs one fsync instead of one each. If the writer falls far behind,
+new events are dropped and counted rather than stalling capture or triage.
+
+Reads open their own connection per thread; WAL lets them run alongside the writer.
+query() pages newest first with a (ts, id) cursor, so every page is an index range
+scan however deep the history goes.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EVENT_DB = os.getenv("EVENT_DB", "lifeline_events.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    type TEXT NOT NULL,
+    camera_id TEXT,
+    session_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts, id);
+CREATE INDEX IF NOT EXISTS events_type_ts ON events (type, ts, id);
+CREATE INDEX IF NOT EXISTS events_camera_ts ON events (camera_id, ts, id);
+CREATE INDEX IF NOT EXISTS events_session_ts ON events (session_id, ts, id);
+"""
+
+
+class EventStore:
+    def __init__(self, path=EVENT_DB, batch_size=500, max_pending=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+        self._thread = threading.Thread(
+            target=self._write_loop, name="event-store", daemon=True)
+        self._thread.start()
+
+    def put(self, event_type, data, camera_id=None, session_id=None, ts=None):
+        """Queues an event for writing. Never blocks; returns False if it was dropped."""
+        try:
+            self._queue.put_nowait((ts or time.time(), event_type, camera_id, session_id,
+                                    json.dumps(data, default=str)))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Blocks until everything queued so far has been written."""
+        self._queue.join()
+
+    def query(self, event_type=None, camera_id=None, session_id=None, since=None, until=None,
+              before=None, limit=100):
+        """
+        Events matching the filters, newest first. Pass the returned cursor as before=
+        to get the next page; it is None on the last page.
+        """
+        clauses, params = [], []
+        for column, value in (("type", event_type), ("camera_id", camera_id),
+                              ("session_id", session_id)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts <= ?")
+            params.append(until)
+        if before is not None:
+            before_ts, before_id = before
+            clauses.append("(ts, id) < (?, ?)")
+            params.extend([before_ts, before_id])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connect().execute(
+            f"SELECT id, ts, type, camera_id, session_id, data FROM events {where} "
+            "ORDER BY ts DESC, id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+
+        events = [{
+            "id": row[0],
+            "ts": row[1],
+            "type": row[2],
+            "camera_id": row[3],
+            "session_id": row[4],
+            "data": json.loads(row[5]),
+        } for row in rows[:limit]]
+        cursor = (events[-1]["ts"], events[-1]["id"]) if len(rows) > limit else None
+        return events, cursor
+
+    def stats(self):
+        return {"pending": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            # With WAL, NORMAL only syncs at checkpoints and still can't corrupt the database
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            # Take whatever else is already waiting
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO events (ts, type, camera_id, session_id, data) "
+                        "VALUES (?, ?, ?, ?, ?)", batch)
+                self.written += len(batch)
+            except sqlite3.Error as e:
+                self.dropped += len(batch)
+                print(f"[Events] Failed to write {len(batch)} events: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,170 @@
+"""
+Binary frame transport.
+
+Each camera frame is JPEG-encoded once into a bytes buffer. The same buffer is sent
+to the frontend as a binary WebSocket message and referenced (not copied) by the
+VLM batch. Batches go to the VLM server as one binary message in a length-prefixed
+container:
+
+    magic     4 bytes          b"LLF1"
+    meta_len  uint32           length of the JSON metadata block
+    count     uint32           number of frames
+    lengths   count x uint32   byte length of each frame
+    meta      meta_len bytes   UTF-8 JSON object
+    frames    JPEG payloads, back to back
+
+All integers are big-endian.
+
+The browser preview and the VLM get separate EncodingProfiles (resolution, JPEG
+quality, color mode). When both would produce the same image, the frame is
+encoded only once and shared.
+"""
+import json
+import os
+import struct
+from dataclasses import dataclass
+
+import cv2
+from dotenv import load_dotenv
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_GRAY, TJSAMP_GRAY
+    turbojpeg = TurboJPEG()
+except Exception:
+    turbojpeg = None
+
+load_dotenv()
+
+MAGIC = b"LLF1"
+_HEADER = struct.Struct("!4sII")
+
+# "cv2", "simplejpeg", "turbojpeg", or "auto" for the first of simplejpeg / turbojpeg
+# that is installed. The OpenCV wheels already bundle libjpeg-turbo, so the others
+# mainly help on builds that don't (or to skip OpenCV's extra copy into bytes).
+JPEG_BACKEND = os.getenv("JPEG_BACKEND", "cv2")
+
+
+def _pick_backend(name):
+    if name == "auto":
+        if simplejpeg is not None:
+            return "simplejpeg"
+        if turbojpeg is not None:
+            return "turbojpeg"
+        return "cv2"
+    if name == "simplejpeg" and simplejpeg is None:
+        print("simplejpeg is not installed, falling back to OpenCV.")
+        return "cv2"
+    if name == "turbojpeg" and turbojpeg is None:
+        print("PyTurboJPEG is not installed, falling back to OpenCV.")
+        return "cv2"
+    return name
+
+
+backend = _pick_backend(JPEG_BACKEND)
+
+
+def encode_frame(frame, quality=95):
+    """JPEG-encodes a BGR or grayscale frame. Returns the JPEG bytes, or None if encoding failed."""
+    grayscale = frame.ndim == 2
+    try:
+        if backend == "simplejpeg":
+            if grayscale:
+                return simplejpeg.encode_jpeg(frame[:, :, None], quality=quality, colorspace="GRAY")
+            return simplejpeg.encode_jpeg(frame, quality=quality, colorspace="BGR", colorsubsampling="420")
+        if backend == "turbojpeg":
+            if grayscale:
+                return turbojpeg.encode(frame[:, :, None], quality=quality,
+                                        pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+            return turbojpeg.encode(frame, quality=quality, pixel_format=TJPF_BGR)
+    except Exception as e:
+        print(f"{backend} failed to encode frame: {e}")
+        return None
+
+    success, buffer = cv2.imencode(
+        '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        return None
+    return buffer.tobytes()
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """How frames are encoded for one consumer; max_width=None keeps the camera resolution."""
+    max_width: int = None
+    quality: int = 95
+    grayscale: bool = False
+
+    def output_size(self, width, height, scale=1.0):
+        if self.max_width and width * scale > self.max_width:
+            scale = self.max_width / width
+        if scale >= 1:
+            return width, height
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def same_output(self, other, width, height, scale=1.0):
+        """True if other, at full scale, would encode this frame to exactly the same JPEG."""
+        return (self.quality == other.quality and self.grayscale == other.grayscale
+                and self.output_size(width, height, scale) == other.output_size(width, height))
+
+    def encode(self, frame, scale=1.0):
+        height, width = frame.shape[:2]
+        size = self.output_size(width, height, scale)
+        if size != (width, height):
+            # INTER_AREA averages whole pixel blocks, the right filter for shrinking
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if self.grayscale and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return encode_frame(frame, self.quality)
+
+
+def _env_profile(prefix, max_width, quality, grayscale):
+    return EncodingProfile(
+        max_width=int(os.getenv(f"{prefix}_MAX_WIDTH", max_width or 0)) or None,
+        quality=int(os.getenv(f"{prefix}_JPEG_QUALITY", quality)),
+        grayscale=os.getenv(f"{prefix}_GRAYSCALE", str(grayscale)).lower() in ("1", "true", "yes"),
+    )
+
+
+# The preview keeps the camera resolution; the VLM gets smaller, lighter frames
+PREVIEW_PROFILE = _env_profile("PREVIEW", None, 80, False)
+INFERENCE_PROFILE = _env_profile("INFERENCE", 640, 70, False)
+
+
+def pack_frames(frames, meta=None):
+    """Packs a list of JPEG buffers (plus optional metadata) into one binary message."""
+    meta_bytes = json.dumps(meta or {}).encode("utf-8")
+    header = _HEADER.pack(MAGIC, len(meta_bytes), len(frames))
+    lengths = struct.pack(f"!{len(frames)}I", *(len(f) for f in frames))
+    return b"".join([header, lengths, meta_bytes, *frames])
+
+
+def unpack_frames(data):
+    """
+    Inverse of pack_frames. Returns (meta, frames), where frames are memoryview
+    slices into data rather than copies.
+    """
+    view = memoryview(data)
+    magic, meta_len, count = _HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a frame container.")
+
+    offset = _HEADER.size
+    lengths = struct.unpack_from(f"!{count}I", view, offset)
+    offset += 4 * count
+
+    meta = json.loads(bytes(view[offset:offset + meta_len]).decode("utf-8"))
+    offset += meta_len
+
+    frames = []
+    for length in lengths:
+        frames.append(view[offset:offset + length])
+        offset += length
+    if offset != len(view):
+        raise ValueError("Frame container is truncated or has trailing data.")
+
+    return meta, frames
@@ -0,0 +1,222 @@
+"""
+Pre-event footage.
+
+FrameRing keeps the most recent encoded frames of one camera in a single bytearray
+allocated up front, with slot metadata in preallocated arrays, so recording a frame
+is one memcpy into the arena and never allocates. When a frame doesn't fit before
+the end of the arena it wraps to the start, and the oldest frames are evicted as
+their bytes get overwritten (or when every slot is taken).
+
+When a fall is reported, ClipRecorder waits on its own thread for the post-roll to
+be captured, copies [event - pre_roll, event + post_roll] out of the ring and hands
+the Clip to its handlers (dashboard store, re-analysis, ...), so capture never waits.
+"""
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+from dotenv import load_dotenv
+from frame_codec import pack_frames
+
+load_dotenv()
+
+FRAME_RING_MB = float(os.getenv("FRAME_RING_MB", "32"))
+FRAME_RING_MAX_FRAMES = int(os.getenv("FRAME_RING_MAX_FRAMES", "1024"))
+CLIP_PRE_ROLL = float(os.getenv("CLIP_PRE_ROLL", "5"))
+CLIP_POST_ROLL = float(os.getenv("CLIP_POST_ROLL", "3"))
+
+
+class FrameRing:
+    def __init__(self, capacity_bytes=int(FRAME_RING_MB * 1024 * 1024), max_frames=FRAME_RING_MAX_FRAMES):
+        self.capacity = capacity_bytes
+        self.max_frames = max_frames
+        self.arena = bytearray(capacity_bytes)
+
+        self.offsets = np.zeros(max_frames, dtype=np.int64)
+        self.lengths = np.zeros(max_frames, dtype=np.int64)
+        self.timestamps = np.zeros(max_frames, dtype=np.float64)
+
+        self.head = 0  # slot of the oldest frame
+        self.count = 0
+        self.write_pos = 0
+        self.frames_written = 0
+        self.dropped = 0
+        self._cond = threading.Condition()
+
+    def append(self, jpeg, ts):
+        """Copies an encoded frame into the arena, evicting the oldest frames it overwrites."""
+        size = len(jpeg)
+        if size > self.capacity:
+            self.dropped += 1
+            return
+
+        with self._cond:
+            start = self.write_pos
+            if start + size > self.capacity:
+                # Wrap; whatever is left between here and the end is the oldest data
+                while self.count and self.offsets[self.head] >= start:
+                    self._pop()
+                start = 0
+            while self.count and (self.count == self.max_frames or self._overlaps(self.head, start, size)):
+                self._pop()
+
+            self.arena[start:start + size] = jpeg
+            slot = (self.head + self.count) % self.max_frames
+            self.offsets[slot] = start
+            self.lengths[slot] = size
+            self.timestamps[slot] = ts
+            self.count += 1
+            self.write_pos = start + size
+            self.frames_written += 1
+            self._cond.notify_all()
+
+    def latest_ts(self):
+        with self._cond:
+            if not self.count:
+                return None
+            return float(self.timestamps[(self.head + self.count - 1) % self.max_frames])
+
+    def wait_until(self, ts, timeout):
+        """Blocks until a frame at or after ts is in the ring, or timeout. Returns whether it arrived."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                latest = self.latest_ts()
+                if latest is not None and latest >= ts:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+    def extract(self, start_ts, end_ts):
+        """Copies out the frames with start_ts <= ts <= end_ts, oldest first."""
+        frames, timestamps = [], []
+        with self._cond:
+            for i in range(self.count):
+                slot = (self.head + i) % self.max_frames
+                ts = float(self.timestamps[slot])
+                if ts < start_ts:
+                    continue
+                if ts > end_ts:
+                    break
+                offset, length = int(self.offsets[slot]), int(self.lengths[slot])
+                frames.append(bytes(self.arena[offset:offset + length]))
+                timestamps.append(ts)
+        return frames, timestamps
+
+    def stats(self):
+        with self._cond:
+            used = int(self.lengths[[(self.head + i) % self.max_frames for i in range(self.count)]].sum()) \
+                if self.count else 0
+            oldest = float(self.timestamps[self.head]) if self.count else None
+            return {
+                "frames": self.count,
+                "bytes": used,
+                "capacity_bytes": self.capacity,
+                "seconds": (self.latest_ts() - oldest) if self.count else 0.0,
+                "dropped": self.dropped,
+            }
+
+    def _overlaps(self, slot, start, size):
+        offset = self.offsets[slot]
+        return offset < start + size and start < offset + self.lengths[slot]
+
+    def _pop(self):
+        self.head = (self.head + 1) % self.max_frames
+        self.count -= 1
+
+
+@dataclass
+class Clip:
+    clip_id: str
+    camera_id: str
+    event_ts: float
+    frames: list = field(repr=False)
+    timestamps: list = field(repr=False)
+    info: dict = field(default_factory=dict)
+
+    def summary(self):
+        return {
+            "clip_id": self.clip_id,
+            "camera_id": self.camera_id,
+            "event_ts": self.event_ts,
+            "start_ts": self.timestamps[0] if self.timestamps else None,
+            "end_ts": self.timestamps[-1] if self.timestamps else None,
+            "frames": len(self.frames),
+            "bytes": sum(len(f) for f in self.frames),
+            **self.info,
+        }
+
+    def to_container(self):
+        """The clip in the LLF1 frame container, with timestamps in the metadata."""
+        return pack_frames(self.frames, {"clip_id": self.clip_id, "camera_id": self.camera_id,
+                                         "event_ts": self.event_ts, "timestamps": self.timestamps})
+
+
+class ClipRecorder:
+    """Cuts clips around events on a background thread and passes them to handlers."""
+
+    def __init__(self, camera_id, ring, pre_roll=CLIP_PRE_ROLL, post_roll=CLIP_POST_ROLL, handlers=None):
+        self.camera_id = camera_id
+        self.ring = ring
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        # Called with each Clip, in order; a failing handler doesn't stop the others
+        self.handlers = list(handlers or [])
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"clips-{camera_id}", daemon=True)
+        self._thread.start()
+
+    def request(self, event_ts, **info):
+        """Queues a clip around event_ts. Returns immediately."""
+        self._requests.put((event_ts, info))
+
+    def _run(self):
+        while True:
+            event_ts, info = self._requests.get()
+            end_ts = event_ts + self.post_roll
+            # If capture stops, cut the clip with whatever post-roll there is
+            self.ring.wait_until(end_ts, timeout=self.post_roll + 5)
+
+            frames, timestamps = self.ring.extract(event_ts - self.pre_roll, end_ts)
+            if not frames:
+                print(f"[Camera {self.camera_id}] No frames to clip around {event_ts:.2f}.")
+                continue
+
+            clip = Clip(f"{self.camera_id}-{int(event_ts * 1000)}", self.camera_id,
+                        event_ts, frames, timestamps, info)
+            print(f"[Camera {self.camera_id}] Clip {clip.clip_id}: {len(frames)} frames.")
+            for handler in self.handlers:
+                try:
+                    handler(clip)
+                except Exception as e:
+                    print(f"[Camera {self.camera_id}] Clip handler failed: {e}")
+
+
+class ClipStore:
+    """Keeps the most recent clips in memory for the dashboard."""
+
+    def __init__(self, max_clips=8):
+        self.max_clips = max_clips
+        self.clips = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, clip):
+        with self._lock:
+            self.clips[clip.clip_id] = clip
+            while len(self.clips) > self.max_clips:
+                self.clips.popitem(last=False)
+
+    def get(self, clip_id):
+        with self._lock:
+            return self.clips.get(clip_id)
+
+    def list(self):
+        with self._lock:
+            return [clip.summary() for clip in self.clips.values()]
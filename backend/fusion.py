@@ -0,0 +1,138 @@
+"""
+Temporal fusion of VLM verdicts.
+
+A single batch reported as a fall used to start a triage session on its own, so one
+flickering false positive cost a whole conversation (Claude calls, speech, maybe a
+phone call). VerdictFusion decides over the stream of verdicts instead:
+
+  - k-of-n voting: the last n verdicts must hold at least k votes for a fall; a fall
+    counts as a full vote from min_vote_confidence up and as a partial one below,
+    and n falls in a row are always enough
+  - smoothing: a fall score moves toward 1 on fall verdicts and toward 0 otherwise,
+    in steps weighted by each verdict's confidence
+  - hysteresis: the score must reach enter to trigger, and after a trigger it must
+    fall back below exit before the detector can trigger again
+  - cooldown: at least cooldown seconds between triggers
+
+When a fall verdict doesn't settle it yet, fusion asks for one confirmation batch
+right away, so a real fall is confirmed within a round trip rather than waiting for
+the next full window. After max_failed_confirmations confirmations in a row that
+didn't settle it, it stops asking until a verdict without a fall and relies on the
+regular windows.
+"""
+import os
+from collections import deque
+from dataclasses import asdict, dataclass
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FUSION_K = int(os.getenv("FUSION_K", "2"))
+FUSION_N = int(os.getenv("FUSION_N", "3"))
+FUSION_ENTER = float(os.getenv("FUSION_ENTER", "0.6"))
+FUSION_EXIT = float(os.getenv("FUSION_EXIT", "0.3"))
+FUSION_COOLDOWN = float(os.getenv("FUSION_COOLDOWN", "30"))
+
+# Decisions
+IGNORE = "ignore"
+CONFIRM = "confirm"
+TRIGGER = "trigger"
+
+
+@dataclass
+class FusionDecision:
+    action: str
+    score: float
+    votes: float
+    reason: str
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class VerdictFusion:
+    def __init__(self, k=FUSION_K, n=FUSION_N, enter=FUSION_ENTER, exit=FUSION_EXIT,
+                 cooldown=FUSION_COOLDOWN, alpha=0.5, min_vote_confidence=0.5,
+                 default_confidence=1.0, confirm_timeout=10.0, max_failed_confirmations=2):
+        self.k = k
+        self.enter = enter
+        self.exit = exit
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.min_vote_confidence = min_vote_confidence
+        # Used when the server doesn't report a confidence
+        self.default_confidence = default_confidence
+        self.confirm_timeout = confirm_timeout
+        self.max_failed_confirmations = max_failed_confirmations
+
+        self.votes = deque(maxlen=n)
+        self.score = 0.0
+        self.armed = True
+        self.last_trigger = None
+        self.confirm_requested = None
+        self.triggers = 0
+        self.suppressed = 0
+        self.confirmations = 0
+        self.failed_confirmations = 0
+
+    def observe(self, response, now):
+        """Folds one verdict in and returns what the camera should do about it."""
+        fall = bool(response.get("fall"))
+        confidence = response.get("confidence")
+        confidence = self.default_confidence if confidence is None else min(
+            max(float(confidence), 0.0), 1.0)
+
+        self.score += self.alpha * confidence * ((1.0 if fall else 0.0) - self.score)
+        self.votes.append(
+            min(1.0, confidence / self.min_vote_confidence) if fall else 0.0)
+        votes = round(sum(self.votes), 3)
+        sustained = len(self.votes) == self.votes.maxlen and all(self.votes)
+        # Any verdict answers an outstanding confirmation request
+        confirming = self.confirm_requested is not None and \
+            now - self.confirm_requested < self.confirm_timeout
+        self.confirm_requested = None
+
+        if not self.armed and self.score <= self.exit:
+            self.armed = True
+
+        if not fall:
+            self.failed_confirmations = 0
+            return self._decide(IGNORE, votes, "no fall")
+        if not self.armed:
+            return self._suppress(votes, "still latched from the last trigger")
+        if self.last_trigger is not None and now - self.last_trigger < self.cooldown:
+            return self._suppress(votes, "cooling down")
+
+        if self.score >= self.enter and (votes >= self.k or sustained):
+            self.armed = False
+            self.last_trigger = now
+            self.triggers += 1
+            self.failed_confirmations = 0
+            return self._decide(TRIGGER, votes, f"{votes} votes in the last {len(self.votes)} verdicts")
+
+        if confirming:
+            # The confirmation came back a fall but still didn't clear the bar
+            self.failed_confirmations += 1
+            return self._suppress(votes, "not confirmed")
+        if self.failed_confirmations >= self.max_failed_confirmations:
+            return self._suppress(votes, "confirmations keep failing")
+        self.confirm_requested = now
+        self.confirmations += 1
+        return self._decide(CONFIRM, votes, "needs confirmation")
+
+    def stats(self):
+        return {
+            "score": round(self.score, 3),
+            "armed": self.armed,
+            "triggers": self.triggers,
+            "suppressed": self.suppressed,
+            "confirmations": self.confirmations,
+        }
+
+    def _suppress(self, votes, reason):
+        self.suppressed += 1
+        return self._decide(IGNORE, votes, reason)
+
+    def _decide(self, action, votes, reason):
+        return FusionDecision(action, round(self.score, 3), votes, reason)
@@ -0,0 +1,198 @@
+"""
+Continuous background listening for triage replies.
+
+Listener keeps the microphone open on its own thread. It calibrates the energy
+threshold once, keeps a short ring buffer of recent audio so the start of a reply is
+never clipped, and uses energy-based voice activity detection to find where each
+utterance ends. It listens while the agent is still speaking, so a reply that starts
+during TTS is already being captured and is ready as soon as it ends.
+
+Utterances are only queued while a triage session is active. Ones that begin and end
+entirely while the agent is talking are treated as echo of our own voice and dropped.
+"""
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import speech_recognition as sr
+
+
+class Listener:
+    def __init__(self, pre_roll=0.5, pause=0.8, min_speech=0.25, max_utterance=15.0,
+                 echo_tail=0.3):
+        self.pre_roll = pre_roll
+        self.pause = pause
+        self.min_speech = min_speech
+        self.max_utterance = max_utterance
+        self.echo_tail = echo_tail
+
+        self.recognizer = sr.Recognizer()
+        self.energy_threshold = None
+        self.sample_rate = None
+        self.sample_width = None
+        self.active = False
+        self.in_speech = False
+
+        self._speaking = False
+        self._speech_windows = deque(maxlen=16)
+        self._utterances = queue.Queue(maxsize=8)
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="listener", daemon=True)
+            self._thread.start()
+
+    def wait_ready(self, timeout=None):
+        """Blocks until the microphone is open and calibrated."""
+        return self._ready.wait(timeout)
+
+    def activate(self):
+        """Starts queueing utterances, dropping anything left from before."""
+        self.clear()
+        self.active = True
+
+    def deactivate(self):
+        self.active = False
+        self.clear()
+
+    def clear(self):
+        while True:
+            try:
+                self._utterances.get_nowait()
+            except queue.Empty:
+                return
+
+    def mark_speaking(self, speaking):
+        """Called by the speech worker when TTS starts and stops."""
+        now = time.time()
+        with self._lock:
+            if speaking and not self._speaking:
+                self._speech_windows.append([now, None])
+            elif not speaking and self._speaking and self._speech_windows:
+                self._speech_windows[-1][1] = now
+            self._speaking = speaking
+
+    def next_utterance(self, timeout):
+        """
+        Returns the next utterance as sr.AudioData, or None if nobody spoke within
+        timeout seconds. If a reply is still in progress at the timeout, waits for it.
+        """
+        deadline = time.time() + timeout
+        # Someone mid-sentence at the timeout gets up to max_utterance to finish
+        hard_deadline = deadline + self.max_utterance
+        while True:
+            try:
+                return self._utterances.get(timeout=0.1)
+            except queue.Empty:
+                pass
+            now = time.time()
+            if now >= hard_deadline or (now >= deadline and not self.in_speech):
+                return None
+
+    def _is_echo(self, start, end):
+        with self._lock:
+            for speech_start, speech_end in self._speech_windows:
+                if speech_end is None:
+                    speech_end = math.inf if self._speaking else speech_start
+                if start >= speech_start and end <= speech_end + self.echo_tail:
+                    return True
+        return False
+
+    def _run(self):
+        microphone = sr.Microphone()
+        with microphone as source:
+            # Calibrate once instead of on every turn
+            self.recognizer.adjust_for_ambient_noise(source, duration=1)
+            self.energy_threshold = self.recognizer.energy_threshold
+            self.sample_rate = source.SAMPLE_RATE
+            self.sample_width = source.SAMPLE_WIDTH
+            chunk_seconds = source.CHUNK / source.SAMPLE_RATE
+            self._ready.set()
+            print(
+                f"[Listener] Calibrated, energy threshold {self.energy_threshold:.0f}.")
+
+            ring = deque(maxlen=max(1, int(self.pre_roll / chunk_seconds)))
+            chunks = []
+            speech_start = None
+            speech_seconds = 0.0
+            silence = 0.0
+
+            while True:
+                try:
+                    buffer = source.stream.read(source.CHUNK)
+                except Exception as e:
+                    print(f"[Listener] Microphone read failed: {e}")
+                    time.sleep(0.5)
+                    continue
+                now = time.time()
+
+                samples = np.frombuffer(buffer, dtype=np.int16).astype(
+                    np.float32)
+                energy = float(np.sqrt(np.mean(samples * samples))
+                               ) if samples.size else 0.0
+                voiced = energy > self.energy_threshold
+
+                if not self.in_speech:
+                    ring.append(buffer)
+                    if voiced:
+                        self.in_speech = True
+                        speech_start = now - chunk_seconds * len(ring)
+                        chunks = list(ring)
+                        speech_seconds = chunk_seconds
+                        silence = 0.0
+                    elif not self._speaking:
+                        # Track slow changes in background noise, like the recognizer does
+                        damping = self.recognizer.dynamic_energy_adjustment_damping ** chunk_seconds
+                        target = energy * self.recognizer.dynamic_energy_ratio
+                        self.energy_threshold = self.energy_threshold * \
+                            damping + target * (1 - damping)
+                    continue
+
+                chunks.append(buffer)
+                if voiced:
+                    speech_seconds += chunk_seconds
+                    silence = 0.0
+                else:
+                    silence += chunk_seconds
+
+                too_long = now - speech_start >= self.max_utterance
+                if silence >= self.pause or too_long:
+                    self.in_speech = False
+                    ring.clear()
+                    self._finish(chunks, speech_start,
+                                 now - silence, speech_seconds)
+                    chunks = []
+
+    def _finish(self, chunks, start, end, speech_seconds):
+        if not self.active or speech_seconds < self.min_speech:
+            return
+        if self._is_echo(start, end):
+            return
+
+        audio = sr.AudioData(b"".join(chunks),
+                             self.sample_rate, self.sample_width)
+        try:
+            self._utterances.put_nowait(audio)
+        except queue.Full:
+            print("[Listener] Utterance queue full, dropping reply.")
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_listener():
+    """Returns the process-wide listener, opening the microphone on first use."""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = Listener()
+            _listener.start()
+        return _listener
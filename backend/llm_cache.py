@@ -0,0 +1,200 @@
+"""
+Record/replay cache for Claude calls.
+
+Each request is keyed by a SHA-256 of everything that determines the answer: the
+model, system prompt, messages, sampling parameters and the structured response model
+(its JSON schema), so any prompt change is a new key. Responses are stored as one JSON
+file per key under LLM_CACHE_DIR; the least recently used ones are evicted past
+LLM_CACHE_MAX_ENTRIES.
+
+LLM_CACHE selects the mode:
+
+    off     no caching (default)
+    record  serve hits from the cache, call the API on a miss and store the answer
+    replay  serve only from the cache and raise CacheMiss otherwise; no network or
+            API key needed, so recorded evals and benchmarks replay deterministically
+
+Identical requests made on purpose for different samples (like data generation
+batches) pass a variant so they don't collapse into one entry.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MODES = ("off", "record", "replay")
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def _jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+
+def request_key(request, response_model=None, variant=None):
+    """Content hash of a request, stable across runs and dict orderings."""
+    payload = {"request": request, "variant": variant}
+    if response_model is not None:
+        payload["response_model"] = {
+            "name": response_model.__name__,
+            "schema": response_model.model_json_schema(),
+        }
+    encoded = json.dumps(payload, sort_keys=True,
+                         separators=(",", ":"), default=_jsonable)
+    return hashlib.sha256(encoded.encode("utf8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path=".llm_cache", mode="off", max_entries=10000):
+        if mode not in MODES:
+            raise ValueError(f"LLM cache mode must be one of {MODES}, got {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Counted on the first store, so eviction only scans the store when it's full
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def lookup(self, request, response_model=None, variant=None):
+        """
+        Returns the recorded response (parsed into response_model if given), or None
+        on a miss. In replay mode a miss raises CacheMiss instead.
+        """
+        if not self.enabled:
+            return None
+
+        key = request_key(request, response_model, variant)
+        file_path = self._file(key)
+        try:
+            with open(file_path, "r", encoding="utf8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            if self.mode == "replay":
+                raise CacheMiss(f"No recorded response for request {key[:12]}")
+            return None
+
+        # Touch for LRU eviction
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+
+        value = entry["response"]
+        return response_model(**value) if response_model is not None else value
+
+    def store(self, request, response, response_model=None, variant=None):
+        if self.mode != "record":
+            return
+
+        key = request_key(request, response_model, variant)
+        if hasattr(response, "model_dump"):
+            response = response.model_dump()
+        entry = {"key": key, "recorded_at": time.time(),
+                 "model": request.get("model"), "response": response}
+
+        file_path = self._file(key)
+        is_new = not os.path.exists(file_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Write then rename so a concurrent reader never sees half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf8") as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, file_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._entries is None:
+                self._entries = len(self._scan())
+            elif is_new:
+                self._entries += 1
+            full = self._entries > self.max_entries
+        if full:
+            self._evict()
+
+    def cached(self, request, fetch, response_model=None, variant=None):
+        """Returns the cached response for request, or fetch()'s result (stored when recording)."""
+        response = self.lookup(request, response_model, variant)
+        if response is not None:
+            return response
+        response = fetch()
+        self.store(request, response, response_model, variant)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {"mode": self.mode, "hits": self.hits, "misses": self.misses}
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + ".json")
+
+    def _scan(self):
+        """(last used, path) for every entry on disk."""
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith(".json"):
+                    file_path = os.path.join(root, name)
+                    try:
+                        entries.append((os.path.getmtime(file_path), file_path))
+                    except OSError:
+                        pass
+        return entries
+
+    def _evict(self):
+        """Removes least recently used entries down to 90% of max_entries."""
+        with self._lock:
+            entries = sorted(self._scan())
+            keep = int(self.max_entries * 0.9)
+            for _, file_path in entries[:max(0, len(entries) - keep)]:
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+            self._entries = min(len(entries), keep)
+
+
+cache = LLMCache(
+    path=os.getenv("LLM_CACHE_DIR", ".llm_cache"),
+    mode=os.getenv("LLM_CACHE", "off").lower(),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+)
+
+
+def replaying():
+    """True when every Claude call is answered from the cache (no API key needed)."""
+    return cache.mode == "replay"
+
+
+def lookup(request, response_model=None, variant=None):
+    return cache.lookup(request, response_model, variant)
+
+
+def store(request, response, response_model=None, variant=None):
+    cache.store(request, response, response_model, variant)
+
+
+def cached(request, fetch, response_model=None, variant=None):
+    return cache.cached(request, fetch, response_model, variant)
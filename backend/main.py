@@ -1,229 +1,278 @@
-import base64
 import json
-import platform
+import math
+import os
 import queue
 import sys
-import threading
-import time
 
-import cv2
-import websocket
-from flask import Flask
+import metrics
+from flask import Flask, Response, abort, request
 from flask_sock import Sock
+from broadcast import BroadcastHub
+from camera import CameraManager, default_camera_source, parse_camera_sources
+from conversation import token_totals
+from event_store import EventStore
+from frame_ring import ClipStore
+from listener import get_listener
+from speech import get_speech_worker
 from triage import triaging_agent
+from triage_session import TriageSessionManager
+from vlm_link import vlm_connections
 
 app = Flask(__name__)
 sock = Sock(app)
 
 DEBUG = False
 
-framerate = 2
-triage_message_queue = queue.Queue()
-fall_detected_queue = queue.Queue()
-frame_update_queue = queue.Queue()
+# Each dashboard socket subscribes to one of these hubs; every client gets every
+# event, slow clients lose their oldest events, and new clients get a short replay.
+# Falls are not replayed: a dashboard opened later would raise an old alert again
+triage_message_hub = BroadcastHub("triage", buffer_size=256, replay=50)
+fall_detected_hub = BroadcastHub("fall_detected", buffer_size=16)
+frame_update_hub = BroadcastHub("frame_update", buffer_size=16, replay=1)
+# Clips cut around detected falls, and the VLM's second look at each
+clip_hub = BroadcastHub("clips", buffer_size=16, replay=4)
+clip_store = ClipStore()
+
+# Detections, verdicts, clips and transcripts, kept across restarts
+event_store = EventStore()
+
+# Triage runs on its own worker so the capture loop keeps going during a session
+triage_sessions = TriageSessionManager(
+    triaging_agent, triage_message_hub, event_store=event_store)
+
+# One capture thread and inference pipeline per camera, shared by all viewers
+cameras = CameraManager(
+    parse_camera_sources(
+        os.getenv("CAMERA_SOURCES") or str(default_camera_source())),
+    triage_sessions=triage_sessions,
+    fall_detected_hub=fall_detected_hub,
+    frame_update_hub=frame_update_hub,
+    debug=lambda: DEBUG,
+    clip_hub=clip_hub,
+    clip_handlers=[
+        clip_store.add,
+        lambda clip: event_store.put("clip", clip.summary(), camera_id=clip.camera_id,
+                                     ts=clip.event_ts)
+    ],
+    event_store=event_store
+)
+
+
+def stream_hub(ws, hub, encode):
+    """Sends every event published on hub to ws until the client goes away."""
+    subscription = hub.subscribe()
+    try:
+        while ws.connected:
+            try:
+                event = subscription.get(timeout=1)
+            except queue.Empty:
+                continue
+            if event is None:
+                break
+
+            with metrics.timed("frontend_send", hub=hub.name):
+                ws.send(encode(event))
+    finally:
+        hub.unsubscribe(subscription)
 
 
 @sock.route('/frame_update')
 def frame_update(ws):
-    while True:
-        frame_update = frame_update_queue.get()
-        print("FRAME UPDATE", frame_update)
-        if frame_update is None:
-            break
-
-        ws.send(frame_update)
+    stream_hub(ws, frame_update_hub, json.dumps)
 
 
 @sock.route('/fall_detected')
 def fall_detected(ws):
-    while True:
-        fall_detected = fall_detected_queue.get()
-        if fall_detected is None:
-            break
-
-        ws.send(json.dumps({"fall_detected": "FALL DETECTED"}))
+    stream_hub(ws, fall_detected_hub, json.dumps)
 
 
 @sock.route("/triage")
 def triage_messages(ws):
-    while True:
-        triage_message = triage_message_queue.get()
-        if triage_message is None:
-            break
-
-        ws.send(json.dumps(triage_message))
-
+    stream_hub(ws, triage_message_hub, json.dumps)
 
-def external_processing_thread(frames_queue, response_queue, external_ws):
-    """
-    Runs on a separate thread:
-      - Receives frame batches from frames_queue
-      - Sends them to the external_ws
-      - Waits for response
-      - Puts the response (or a "ready" signal) in the response_queue
-    """
-    try:
-        while True:
-            # Wait for the next batch of frames to process
-            frames_batch = frames_queue.get()
-            if frames_batch is None:
-                break
 
-            # Send the accumulated frames as a JSON array
-            try:
-                message = json.dumps(frames_batch)
-                external_ws.send(message)
-                print(
-                    f"[External Thread] Sent {len(frames_batch)} frames to server.")
-
-                # Wait for response and send back to main thread
-                fall_data = external_ws.recv()
-                if fall_data:
-                    fall_data = json.loads(fall_data)
-                response_queue.put(fall_data)
-            except Exception as e:
-                print(
-                    f"[External Thread] Failed to send frames or receive response: {e}")
-                response_queue.put(None)
-    finally:
-        try:
-            external_ws.close()
-        except:
-            pass
-        print("[External Thread] External WebSocket closed.")
+@sock.route("/clip_events")
+def clip_events(ws):
+    stream_hub(ws, clip_hub, json.dumps)
 
 
-@sock.route('/video_feed')
-def video_feed(ws):
-    """
-    On first connection, opens camera and also connects to an external WebSocket server.
-    Sends live frames to the client in real-time.
-    Batches up frames to send to the external server on a separate thread every 3 seconds,
-    but only if we have received a response (ready signal) from the previous batch.
-    """
-
-    # Pick the right camera index for macOS vs others
-    camera_idx = 1 if platform.system() == "Darwin" else 0
-    cap = cv2.VideoCapture(camera_idx)
-    if not cap.isOpened():
-        print("Could not open camera.")
+def stream_camera(ws, camera_id=None):
+    """Streams live JPEG frames from a shared camera worker to the client."""
+    worker = cameras.get(camera_id)
+    if worker is None:
+        print(f"Unknown camera: {camera_id}")
         return
 
-    # Connect to the northflank WebSocket server
-    # external_ws_url = "ws://localhost:8765"
-    external_ws_url = "wss://p01--vlm-inference--f6l8w976xnkg.code.run"
-    try:
-        external_ws = websocket.WebSocket()
-        external_ws.connect(external_ws_url)
-        print(f"Connected to northflank WebSocket server: {external_ws_url}")
-    except Exception as e:
-        print(f"Failed to connect to external server: {e}")
-        cap.release()
-        return
+    stream_hub(ws, worker.frames, bytes)
 
-    # Queues for communication between main thread and external thread
-    frames_queue = queue.Queue()
-    response_queue = queue.Queue()
 
-    # Start the external processing thread
-    processing_thread = threading.Thread(
-        target=external_processing_thread,
-        args=(frames_queue, response_queue, external_ws),
-        daemon=True
-    )
-    processing_thread.start()
+@sock.route('/video_feed')
+def video_feed(ws):
+    stream_camera(ws)
 
-    # We'll accumulate 3 seconds worth of frames to send in one batch
-    frames_buffer = []
-    start_time = time.time()
 
-    # This flag indicates if the external thread is ready for a new batch.
-    # For the first batch, let's assume we are ready right away.
-    external_ready = True
+@sock.route('/video_feed/<camera_id>')
+def camera_feed(ws, camera_id):
+    stream_camera(ws, camera_id)
 
-    global framerate
-    person_in_frame = False
 
-    try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("Failed to read frame from camera.")
-                break
+@app.route('/cameras', methods=['GET'])
+def camera_status():
+    return {"cameras": cameras.status()}
 
-            # Encode frame as JPEG -> base64
-            success, buffer = cv2.imencode('.jpg', frame)
-            if not success:
-                print("Failed to encode frame.")
-                break
 
-            frame_b64 = base64.b64encode(buffer).decode('utf-8')
+@app.route('/clips', methods=['GET'])
+def clips():
+    return {"clips": clip_store.list()}
 
-            # Send current frame to frontend
-            try:
-                ws.send(frame_b64)
-            except Exception as e:
-                print(f"Failed to send frame to frontend: {e}")
-                break
 
-            # Collect frames for external server *only if* external is ready
-            if external_ready:
-                frames_buffer.append(frame_b64)
+@app.route('/clips/<clip_id>', methods=['GET'])
+def clip(clip_id):
+    """The clip's JPEG frames in the LLF1 frame container (see frame_codec)."""
+    found = clip_store.get(clip_id)
+    if found is None:
+        abort(404)
+    return Response(found.to_container(), mimetype="application/octet-stream")
 
-            # Check if some time has elapsed and the external thread is ready
-            # if (time.time() - start_time >= 6) and external_ready:
-            buffer_length = framerate * 6 if person_in_frame else framerate * 2
-            if len(frames_buffer) >= buffer_length and external_ready:
-                # Send the accumulated frames to the external thread
-                frames_queue.put(frames_buffer)
-                # print(f"[Main Thread] Queued {len(frames_buffer)} frames for processing.")
 
-                # Reset for next 3-second batch
-                frames_buffer = []
-                start_time = time.time()
+def query_arg(name, convert, default=None):
+    """Converts a query parameter, raising ValueError if it is malformed or not finite."""
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    value = convert(value)
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be finite")
+    return value
 
-                # Since we've sent a batch, mark external as not ready
-                external_ready = False
 
-            # Check if there's any response from the external thread
-            # If we get a response, that means it is ready for the next batch
-            try:
-                response = response_queue.get_nowait()
-                # You can do something with the response here if needed
-                if response is not None:
-                    print(f"[Main Thread] Server response: {response}")
-                    if response["fall"] == True or DEBUG:
-                        fall_detected_queue.put("FALL DETECTED")
-                        triaging_agent(triage_message_queue)
-
-                    # Adaptively adjust framerate and rate of inference based on if someone is in the frame.
-                    if response["person"] == True and not person_in_frame:
-                        framerate = 20
-                        person_in_frame = True
-                        frame_update_queue.put(framerate)
-                    elif not response["person"] and person_in_frame:
-                        framerate = 2
-                        person_in_frame = False
-                        frame_update_queue.put(framerate)
-
-                # Mark the external as ready for next batch
-                external_ready = True
-            except queue.Empty:
-                # No response yet; just continue
-                pass
-
-            # Control the frame rate (approximately 30 FPS)
-            time.sleep(1 / framerate)
-
-    except Exception as e:
-        print(f"Exception during streaming: {e}")
-
-    finally:
-        cap.release()
-        # Signal the external processing thread to exit, then join it
-        frames_queue.put(None)
-        processing_thread.join(timeout=5)
-        print("Camera and external processing thread closed.")
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    Event history, newest first. Filters: type, camera_id, session_id, since, until
+    (unix seconds); page with limit (max 500) and the previous page's next cursor.
+    """
+    args = request.args
+    try:
+        before = None
+        if args.get("before"):
+            before_ts, before_id = args["before"].split(":")
+            before = (float(before_ts), int(before_id))
+            if not math.isfinite(before[0]):
+                raise ValueError("before must be finite")
+        results, cursor = event_store.query(
+            event_type=args.get("type"),
+            camera_id=args.get("camera_id"),
+            session_id=query_arg("session_id", int),
+            since=query_arg("since", float),
+            until=query_arg("until", float),
+            before=before,
+            limit=min(max(query_arg("limit", int, 100), 1), 500)
+        )
+    except ValueError:
+        abort(400)
+
+    return {"events": results, "next": f"{cursor[0]!r}:{cursor[1]}" if cursor else None}
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """200 while every VLM link is up, 503 (with details) while any is down."""
+    links = [connection.health() for connection in vlm_connections()]
+    healthy = all(link["connected"] for link in links)
+    return {
+        "healthy": healthy,
+        "vlm": links,
+        "cameras": {w.camera_id: w.running for w in cameras.workers.values()},
+        "triage": triage_sessions.status()["state"],
+    }, 200 if healthy else 503
+
+
+def link_metrics(key, convert=float):
+    return [({"url": c.url}, convert(c.health()[key] or 0)) for c in vlm_connections()]
+
+
+# Link changes go in the event history so outages can be traced afterwards
+for connection in vlm_connections():
+    connection.listeners.append(
+        lambda link: event_store.put("vlm_link", link))
+
+
+def hub_metrics(key):
+    hubs = [triage_message_hub, fall_detected_hub, frame_update_hub, clip_hub] + \
+        [worker.frames for worker in cameras.workers.values()]
+    return [({"hub": hub.name}, hub.stats()[key]) for hub in hubs]
+
+
+def vlm_metrics(key):
+    return [({"camera": worker.camera_id}, worker.pipeline.stats()[key])
+            for worker in cameras.workers.values() if worker.pipeline]
+
+
+metrics.registry.register(
+    "lifeline_hub_buffered", "Events waiting in subscriber buffers.", lambda: hub_metrics("buffered"))
+metrics.registry.register(
+    "lifeline_hub_subscribers", "Connected subscribers.", lambda: hub_metrics("subscribers"))
+metrics.registry.register(
+    "lifeline_hub_dropped_total", "Events dropped for slow subscribers.", lambda: hub_metrics("dropped"), "counter")
+metrics.registry.register(
+    "lifeline_vlm_send_queue", "Batches waiting to be sent to the VLM.", lambda: vlm_metrics("send_queue"))
+metrics.registry.register(
+    "lifeline_vlm_in_flight", "Batches awaiting a VLM response.", lambda: vlm_metrics("in_flight"))
+metrics.registry.register(
+    "lifeline_vlm_ready", "VLM responses held for reordering.", lambda: vlm_metrics("ready"))
+metrics.registry.register(
+    "lifeline_vlm_bytes_sent_total", "Bytes sent to the VLM.", lambda: vlm_metrics("bytes_sent"), "counter")
+metrics.registry.register(
+    "lifeline_vlm_discarded_total", "Stale or timed-out VLM responses.", lambda: vlm_metrics("discarded"), "counter")
+metrics.registry.register(
+    "lifeline_vlm_link_up", "1 while the VLM link is connected.", lambda: link_metrics("connected", int))
+metrics.registry.register(
+    "lifeline_vlm_reconnects_total", "Times the VLM link has reconnected.", lambda: link_metrics("reconnects"), "counter")
+metrics.registry.register(
+    "lifeline_vlm_downtime_seconds_total", "Time the VLM link has been down.", lambda: link_metrics("downtime"), "counter")
+metrics.registry.register(
+    "lifeline_vlm_ping_rtt_seconds", "Last WebSocket ping round trip to the VLM server.", lambda: link_metrics("ping_rtt"))
+metrics.registry.register(
+    "lifeline_vlm_replayed_total", "Windows re-sent after a reconnect.", lambda: vlm_metrics("replayed"), "counter")
+metrics.registry.register(
+    "lifeline_fall_triggers_total", "Fused fall detections that started triage.",
+    lambda: [({"camera": w.camera_id}, w.fusion.triggers) for w in cameras.workers.values()], "counter")
+metrics.registry.register(
+    "lifeline_fall_suppressed_total", "Fall verdicts that fusion did not act on.",
+    lambda: [({"camera": w.camera_id}, w.fusion.suppressed) for w in cameras.workers.values()], "counter")
+metrics.registry.register(
+    "lifeline_fall_confirmations_total", "Confirmation batches requested for possible falls.",
+    lambda: [({"camera": w.camera_id}, w.fusion.confirmations) for w in cameras.workers.values()], "counter")
+metrics.registry.register(
+    "lifeline_frames_captured_total", "Frames read from each camera.",
+    lambda: [({"camera": w.camera_id}, w.frames_captured) for w in cameras.workers.values()], "counter")
+metrics.registry.register(
+    "lifeline_frames_skipped_total", "Captured frames a consumer skipped to stay on its own clock.",
+    lambda: [({"camera": w.camera_id, "consumer": name}, stats["skipped"])
+             for w in cameras.workers.values() for name, stats in w.consumers.items()], "counter")
+metrics.registry.register(
+    "lifeline_frame_ring_bytes", "Bytes of recent frames held for clips.",
+    lambda: [({"camera": w.camera_id}, w.ring.stats()["bytes"]) for w in cameras.workers.values()])
+metrics.registry.register(
+    "lifeline_events_pending", "Events waiting to be written to the event store.",
+    lambda: event_store.stats()["pending"])
+metrics.registry.register(
+    "lifeline_events_dropped_total", "Events the event store could not keep up with.",
+    lambda: event_store.stats()["dropped"], "counter")
+metrics.registry.register(
+    "lifeline_claude_tokens_total", "Triage tokens sent to and received from Claude.",
+    lambda: [({"kind": kind}, count) for kind, count in token_totals.items()], "counter")
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/triage_status', methods=['GET'])
+def triage_status():
+    return triage_sessions.status()
 
 
 @app.route('/debug', methods=['GET'])
@@ -235,4 +284,10 @@ def debug():
 
 if __name__ == "__main__":
     DEBUG = "--debug" in sys.argv
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    # Start the speech engine, pre-render common phrases and calibrate the
+    # microphone before any fall
+    get_speech_worker()
+    get_listener()
+    # The reloader would run this module again in a second process, opening a
+    # second VLM link, camera capture and microphone listener
+    app.run(host="0.0.0.0", port=5001, debug=True, use_reloader=False)
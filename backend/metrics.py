@@ -0,0 +1,144 @@
+"""
+Per-stage timing and queue depth metrics, rendered in the Prometheus text format
+for the /metrics route.
+
+Stages are timed into one histogram, lifeline_stage_seconds, labelled by stage:
+
+    with timed("jpeg_encode", profile="preview"):
+        ...
+
+Values that already live elsewhere (queue depths, hub buffers, pipeline counters)
+are registered as callbacks and read at scrape time.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers everything from a JPEG encode to a full Twilio call placement
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def snapshot(self):
+        """Returns (cumulative bucket counts, count, sum)."""
+        with self._lock:
+            cumulative, total = [], 0
+            for c in self.counts:
+                total += c
+                cumulative.append(total)
+            return cumulative, self.count, self.sum
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = (help_text, Histogram())
+            return self.histograms[key][1]
+
+    def register(self, name, help_text, collect, metric_type="gauge"):
+        """
+        Registers a scrape-time metric. collect() returns a number, or a list of
+        (labels dict, number) pairs for a labelled metric.
+        """
+        with self._lock:
+            self.collectors.append((name, help_text, metric_type, collect))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            collectors = list(self.collectors)
+
+        seen = set()
+        for (name, labels), (help_text, histogram) in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative, count, total = histogram.snapshot()
+            for bound, value in zip(histogram.buckets, cumulative):
+                lines.append(
+                    f"{name}_bucket{_labels(labels, le=bound)} {value}")
+            lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for name, help_text, metric_type, collect in collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"[Metrics] Failed to collect {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if isinstance(values, (int, float)):
+                values = [({}, values)]
+            for labels, value in values:
+                lines.append(
+                    f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"')
+               for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+registry = Registry()
+
+
+def observe(stage, seconds, **labels):
+    registry.histogram("lifeline_stage_seconds",
+                       "Time spent in each pipeline stage.", stage=stage, **labels).observe(seconds)
+
+
+@contextmanager
+def timed(stage, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, **labels)
+
+
+def render():
+    return registry.render()
+
+
+def percentile(values, p):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
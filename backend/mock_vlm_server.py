@@ -0,0 +1,150 @@
+"""
+Local stand-in for the external VLM WebSocket server.
+
+Accepts the binary frame containers sent by VLMPipeline and answers each one with a
+JSON verdict taken from a schedule, after a configurable latency plus random jitter.
+Batches are answered on their own threads, so with jitter replies can come back out
+of order just like from the real server.
+
+The schedule is a list of entries whose times are seconds since the first frame this
+server saw (by capture timestamp). A batch gets the verdict of the last entry that
+overlaps its time span, or {"fall": false, "person": false} if none do:
+
+    [
+        {"from": 0, "to": 60, "person": true},
+        {"from": 20, "to": 23, "person": true, "fall": true, "confidence": 0.9}
+    ]
+
+Usage:
+    python mock_vlm_server.py --port 8765 --latency 0.8 --jitter 0.3 --schedule schedule.json
+    VLM_URL=ws://localhost:8765 python main.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+from flask import Flask
+from flask_sock import Sock
+from werkzeug.serving import make_server
+
+from frame_codec import unpack_frames
+
+DEFAULT_VERDICT = {"fall": False, "person": False}
+
+
+def falls_schedule(fall_times, fall_duration=3.0, person=True):
+    """Builds a schedule with a person in view throughout and a fall at each of fall_times."""
+    schedule = [{"from": 0, "person": person}]
+    for t in fall_times:
+        schedule.append({"from": t, "to": t + fall_duration,
+                        "person": True, "fall": True, "confidence": 0.9})
+    return schedule
+
+
+class MockVLM:
+    def __init__(self, schedule=None, latency=0.5, jitter=0.0, seed=None):
+        self.schedule = schedule or []
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.start_ts = None
+        self.batches = 0
+        self.frames = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def verdict(self, timestamps):
+        """Looks up the scheduled verdict for a batch spanning the given capture timestamps."""
+        with self._lock:
+            if self.start_ts is None and timestamps:
+                self.start_ts = timestamps[0]
+        if not timestamps:
+            return dict(DEFAULT_VERDICT)
+
+        start = timestamps[0] - self.start_ts
+        end = timestamps[-1] - self.start_ts
+        verdict = dict(DEFAULT_VERDICT)
+        for entry in self.schedule:
+            if entry.get("from", 0) <= end and start <= entry.get("to", float("inf")):
+                verdict = {k: v for k, v in entry.items() if k not in (
+                    "from", "to")}
+                verdict.setdefault("fall", False)
+                verdict.setdefault("person", False)
+        return verdict
+
+    def delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def handle(self, ws):
+        send_lock = threading.Lock()
+
+        def respond(meta, num_frames, delay):
+            time.sleep(delay)
+            response = self.verdict(meta.get("timestamps", []))
+            if "seq" in meta:
+                response["seq"] = meta["seq"]
+            response["frames"] = num_frames
+            with send_lock:
+                try:
+                    ws.send(json.dumps(response))
+                except Exception:
+                    pass
+
+        while True:
+            data = ws.receive()
+            if data is None:
+                break
+            if isinstance(data, str):
+                continue
+
+            meta, frames = unpack_frames(data)
+            with self._lock:
+                self.batches += 1
+                self.frames += len(frames)
+                self.bytes_received += len(data)
+            threading.Thread(target=respond, args=(
+                meta, len(frames), self.delay()), daemon=True).start()
+
+
+def create_app(mock):
+    app = Flask(__name__)
+    sock = Sock(app)
+
+    @sock.route('/')
+    def vlm(ws):
+        mock.handle(ws)
+
+    return app
+
+
+def run_in_thread(mock, host="127.0.0.1", port=8765):
+    """Starts the mock server on a background thread. Returns the werkzeug server (call .shutdown())."""
+    server = make_server(host, port, create_app(mock), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock VLM WebSocket server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="Seconds per batch")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Random +/- seconds added to latency")
+    parser.add_argument("--schedule", help="JSON verdict schedule file")
+    parser.add_argument("--fall-at", type=float, nargs="*", default=[],
+                        help="Shortcut: person in view, falls at these times")
+    args = parser.parse_args()
+
+    if args.schedule:
+        with open(args.schedule, "r") as file:
+            schedule = json.load(file)
+    else:
+        schedule = falls_schedule(args.fall_at)
+
+    mock = MockVLM(schedule, args.latency, args.jitter)
+    print(f"Mock VLM server listening on ws://{args.host}:{args.port}")
+    create_app(mock).run(host=args.host, port=args.port)
@@ -0,0 +1,89 @@
+"""
+Local scene-change detection used to gate VLM inference.
+
+Most footage is a still, empty room, so there is no point paying for a remote VLM
+call on every batch. MotionDetector scores each frame against a running-average
+background on a small grayscale copy, and MotionGate turns those scores into
+send / skip decisions for the frame batches.
+"""
+import cv2
+import numpy as np
+
+
+class MotionDetector:
+    """Scores how much of the scene changed, as the fraction of pixels that moved (0..1)."""
+
+    def __init__(self, width=64, alpha=0.05, pixel_threshold=25):
+        self.width = width
+        self.alpha = alpha
+        self.pixel_threshold = pixel_threshold
+        self.background = None
+
+    def update(self, frame):
+        h, w = frame.shape[:2]
+        height = max(1, round(h * self.width / w))
+        small = cv2.resize(frame, (self.width, height),
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        gray = small.astype(np.float32)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            return 0.0
+
+        diff = np.abs(gray - self.background)
+        score = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+
+        # Blend the frame into the background so slow lighting changes fade out
+        cv2.accumulateWeighted(gray, self.background, self.alpha)
+        return float(score)
+
+
+class MotionGate:
+    """
+    Decides whether a batch of frames should go to the VLM:
+      - a motion spike forces a batch right away, even if the buffer isn't full
+      - while there has been recent motion, batches go out as usual
+      - once the scene has been still for quiet_after seconds, only one batch is
+        sent every static_interval seconds (person_static_interval if the VLM last
+        saw a person, so someone lying still after a fall is still checked)
+    """
+
+    def __init__(self, motion_threshold=0.01, spike_threshold=0.08, quiet_after=10.0,
+                 static_interval=30.0, person_static_interval=6.0):
+        self.motion_threshold = motion_threshold
+        self.spike_threshold = spike_threshold
+        self.quiet_after = quiet_after
+        self.static_interval = static_interval
+        self.person_static_interval = person_static_interval
+        self.last_motion = None
+        self.last_sent = None
+        self.spike_pending = False
+        self.skipped_batches = 0
+
+    def observe(self, score, now):
+        """Records a motion score. Returns True if it is a spike that should force a batch."""
+        if score >= self.motion_threshold:
+            self.last_motion = now
+        if score >= self.spike_threshold:
+            self.spike_pending = True
+        return self.spike_pending
+
+    def should_send(self, now, person_in_frame=False):
+        if self.spike_pending:
+            return True
+        if self.last_sent is None:
+            return True
+        if self.last_motion is not None and now - self.last_motion < self.quiet_after:
+            return True
+
+        interval = self.person_static_interval if person_in_frame else self.static_interval
+        return now - self.last_sent >= interval
+
+    def sent(self, now):
+        self.last_sent = now
+        self.spike_pending = False
+
+    def skipped(self):
+        self.skipped_batches += 1
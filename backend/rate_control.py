@@ -0,0 +1,187 @@
+"""
+Sampling rate control for the capture loop.
+
+A RateController decides the capture frame rate, the VLM batch length and the
+inference resolution from what it has measured: VLM round-trip time, scene motion
+and the last detection. FrameScheduler paces the capture loop against absolute
+deadlines, so the time spent on capture, encode and send counts toward each frame
+period instead of being added on top of it.
+"""
+import math
+import time
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class RateDecision:
+    framerate: int
+    batch_frames: int
+    scale: float
+    reason: str
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class RateController:
+    """Base controller with a fixed rate. Subclasses override decide()."""
+
+    def __init__(self, framerate=2, batch_seconds=2):
+        self.framerate = framerate
+        self.batch_seconds = batch_seconds
+        self.person_in_frame = False
+        self.round_trip = None
+
+    def observe_motion(self, score, now):
+        pass
+
+    def observe_round_trip(self, seconds):
+        # Smooth so one slow reply doesn't swing the batch length
+        if self.round_trip is None:
+            self.round_trip = seconds
+        else:
+            self.round_trip = 0.8 * self.round_trip + 0.2 * seconds
+
+    def observe_response(self, response, now):
+        self.person_in_frame = bool(response.get("person"))
+
+    def observe_frame_size(self, width, height):
+        pass
+
+    def decide(self, now):
+        batch_frames = max(1, round(self.framerate * self.batch_seconds))
+        return RateDecision(self.framerate, batch_frames, 1.0, "fixed")
+
+
+class AdaptiveRateController(RateController):
+    """
+    Picks one of a few activity levels and sizes the rest around it:
+      - idle: nobody seen and no recent motion
+      - motion: the scene is changing but the VLM hasn't confirmed a person
+      - person: the VLM sees someone
+      - uncertain: the last verdict was a fall, or its confidence sat in the uncertain band
+    Batches are stretched when the VLM round trip can't keep up with the batch rate,
+    and the inference resolution (then the frame rate) is lowered to stay within
+    pixel_budget megapixels per second sent to the VLM.
+    """
+
+    LEVELS = {
+        # level: (framerate, batch seconds)
+        "idle": (2, 2),
+        "motion": (10, 2),
+        "person": (20, 6),
+        "uncertain": (20, 3),
+    }
+
+    def __init__(self, max_in_flight=2, window_overlap=0.25, pixel_budget=12.0,
+                 min_scale=0.25, max_batch_seconds=10, motion_threshold=0.01, motion_hold=5.0,
+                 uncertain_band=(0.3, 0.7), uncertain_hold=10.0):
+        super().__init__()
+        self.max_in_flight = max_in_flight
+        self.window_overlap = window_overlap
+        self.pixel_budget = pixel_budget
+        self.min_scale = min_scale
+        self.max_batch_seconds = max_batch_seconds
+        self.motion_threshold = motion_threshold
+        self.motion_hold = motion_hold
+        self.uncertain_band = uncertain_band
+        self.uncertain_hold = uncertain_hold
+
+        self.frame_megapixels = None
+        self.last_motion = None
+        self.last_uncertain = None
+
+    def observe_motion(self, score, now):
+        if score >= self.motion_threshold:
+            self.last_motion = now
+
+    def observe_response(self, response, now):
+        super().observe_response(response, now)
+        confidence = response.get("confidence")
+        low, high = self.uncertain_band
+        if response.get("fall") or (confidence is not None and low <= confidence <= high):
+            self.last_uncertain = now
+
+    def observe_frame_size(self, width, height):
+        self.frame_megapixels = width * height / 1e6
+
+    def level(self, now):
+        if self.last_uncertain is not None and now - self.last_uncertain < self.uncertain_hold:
+            return "uncertain"
+        if self.person_in_frame:
+            return "person"
+        if self.last_motion is not None and now - self.last_motion < self.motion_hold:
+            return "motion"
+        return "idle"
+
+    def decide(self, now):
+        level = self.level(now)
+        framerate, batch_seconds = self.LEVELS[level]
+        reasons = [level]
+
+        # The pipeline turns over max_in_flight batches per round trip; if batches
+        # come faster than that they just queue up, so make each one cover more time
+        if self.round_trip is not None:
+            needed = self.round_trip / \
+                (self.max_in_flight * (1 - self.window_overlap))
+            if needed > batch_seconds:
+                batch_seconds = min(needed, self.max_batch_seconds)
+                reasons.append("slow_vlm")
+
+        # Every captured frame ends up in roughly 1 / (1 - overlap) batches
+        scale = 1.0
+        if self.pixel_budget and self.frame_megapixels:
+            load = framerate * self.frame_megapixels / \
+                (1 - self.window_overlap)
+            if load > self.pixel_budget:
+                scale = max(self.min_scale, math.sqrt(
+                    self.pixel_budget / load))
+                # Quantize so small load changes don't cause a new decision every frame
+                scale = max(self.min_scale, math.floor(scale * 4) / 4)
+                reasons.append("budget")
+                scaled_load = load * scale * scale
+                if scaled_load > self.pixel_budget:
+                    framerate = max(
+                        1, int(framerate * self.pixel_budget / scaled_load))
+
+        batch_frames = max(1, round(framerate * batch_seconds))
+        return RateDecision(framerate, batch_frames, scale, ",".join(reasons))
+
+
+class FrameScheduler:
+    """Sleeps until the next frame deadline; falls back into step if it gets too far behind."""
+
+    def __init__(self, framerate, clock=time.monotonic, sleep=time.sleep):
+        self.period = 1 / framerate
+        self.clock = clock
+        self.sleep = sleep
+        self.next_deadline = None
+        self.missed = 0
+
+    def set_rate(self, framerate):
+        self.period = 1 / framerate
+
+    def wait(self):
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        delay = self.next_deadline - now
+        if delay > 0:
+            self.sleep(delay)
+        elif -delay > self.period:
+            # More than a whole frame late; don't try to catch up with a burst
+            self.missed += 1
+            self.next_deadline = now
+        self.next_deadline += self.period
+
+    def due(self, now):
+        """
+        For frames on a simulated clock, which can't be slept on: whether a frame at
+        now is due, moving on to the next deadline if it is.
+        """
+        if self.next_deadline is not None and now < self.next_deadline:
+            return False
+        if self.next_deadline is None or now - self.next_deadline > self.period:
+            self.next_deadline = now
+        self.next_deadline += self.period
+        return True
@@ -0,0 +1,164 @@
+"""
+Long-lived text-to-speech worker.
+
+pyttsx3.init() reloads the speech driver, so instead of creating an engine per
+utterance one SpeechWorker thread owns a single engine and speaks a queue of
+utterances in order. Common phrases (the opening prompt, fallbacks) are rendered to
+WAV ahead of time and kept in an LRU cache, so they play through PyAudio right away
+instead of waiting on synthesis. Without PyAudio, or for phrases the driver can't
+render to WAV, everything is spoken live through the engine.
+"""
+import io
+import os
+import queue
+import tempfile
+import threading
+import wave
+from collections import OrderedDict
+
+import pyttsx3
+from metrics import timed
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+OPENING_PROMPT = "A possible fall has been detected. Are you okay?"
+
+# Rendered when the worker starts, opening prompt first
+COMMON_PHRASES = [
+    OPENING_PROMPT,
+    "I'm having trouble processing right now.",
+    "I couldn't hear you. Can you say that again?",
+    "I'm contacting emergency services now. Stay where you are.",
+]
+
+
+class SpeechWorker:
+    def __init__(self, cache_size=32, prerender=COMMON_PHRASES):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self._queue = queue.Queue()
+        self._engine = None
+        self._audio = None
+        # Called with True/False as speech starts and stops (e.g. Listener.mark_speaking)
+        self.speaking_callbacks = []
+        self._thread = threading.Thread(
+            target=self._run, args=(list(prerender),), name="speech", daemon=True)
+        self._thread.start()
+
+    def say(self, text, cache=False):
+        """
+        Queues text to be spoken and returns an Event that is set once it has been.
+        With cache=True the phrase is rendered once and replayed from the cache after.
+        """
+        done = threading.Event()
+        self._queue.put((text, cache, done))
+        return done
+
+    def wait(self):
+        """Blocks until everything queued so far has been spoken."""
+        self._queue.join()
+
+    def _run(self, prerender):
+        self._engine = pyttsx3.init()
+        if pyaudio is not None:
+            self._audio = pyaudio.PyAudio()
+
+        for phrase in prerender:
+            self._render(phrase)
+
+        while True:
+            text, cache, done = self._queue.get()
+            try:
+                self._speak(text, cache)
+            except Exception as e:
+                print(f"Text to speech failed: {e}")
+                # A driver that errored once tends to stay broken; start a fresh one
+                self._engine = pyttsx3.init()
+            finally:
+                done.set()
+                self._queue.task_done()
+
+    def _speak(self, text, cache):
+        if cache and text not in self.cache:
+            self._render(text)
+
+        self._notify_speaking(True)
+        try:
+            self._say(text)
+        finally:
+            self._notify_speaking(False)
+
+    def _notify_speaking(self, speaking):
+        for callback in self.speaking_callbacks:
+            try:
+                callback(speaking)
+            except Exception as e:
+                print(f"Speaking callback failed: {e}")
+
+    def _say(self, text):
+        audio = self.cache.get(text)
+        if audio is not None:
+            self.cache.move_to_end(text)
+            with timed("tts", cached="true"):
+                self._play(audio)
+            return
+
+        with timed("tts", cached="false"):
+            self._engine.say(text)
+            self._engine.runAndWait()
+
+    def _render(self, text):
+        """Synthesizes text to WAV bytes and stores them in the cache."""
+        if self._audio is None:
+            return
+
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            self._engine.save_to_file(text, path)
+            self._engine.runAndWait()
+            with open(path, "rb") as file:
+                data = file.read()
+            # Make sure it's a WAV we can play (some drivers write other formats)
+            with wave.open(io.BytesIO(data)):
+                pass
+        except Exception as e:
+            print(f"Could not pre-render phrase, it will be spoken live: {e}")
+            return
+        finally:
+            os.remove(path)
+
+        self.cache[text] = data
+        self.cache.move_to_end(text)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _play(self, data):
+        with wave.open(io.BytesIO(data)) as wav:
+            stream = self._audio.open(
+                format=self._audio.get_format_from_width(wav.getsampwidth()),
+                channels=wav.getnchannels(),
+                rate=wav.getframerate(),
+                output=True
+            )
+            try:
+                stream.write(wav.readframes(wav.getnframes()))
+            finally:
+                stream.stop_stream()
+                stream.close()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_speech_worker():
+    """Returns the process-wide speech worker, starting it on first use."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = SpeechWorker()
+        return _worker
@@ -1,10 +1,8 @@
-import pyttsx3
 import speech_recognition as sr
+from speech import get_speech_worker
 
 def text_to_speech(text):
-    engine = pyttsx3.init()
-    engine.say(text)
-    engine.runAndWait()
+    get_speech_worker().say(text).wait()
 
 def speech_to_text():
     recognizer = sr.Recognizer()
@@ -0,0 +1,70 @@
+"""
+Checks that a streamed triage reply survives fields the stream never reached.
+
+    python -m unittest test_triage_stream
+"""
+import json
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from instructor.dsl.partial import Partial
+
+import triage
+from conversation import ConversationState
+
+FIELDS = dict(
+    response_text="Stay still, help is on the way.",
+    reasoning="The person fell and can't get up.",
+    decision_speed=5,
+    information_gain=4,
+    correctness=5,
+    false_positives_negatives=5,
+    total_reward=19,
+    exit_conversation=True,
+    final_decision="alert_emergency",
+)
+
+
+def partial_stream(fields, chunk_size=16):
+    """The partials instructor yields for a reply streamed as JSON in small chunks."""
+    text = json.dumps(fields)
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    return Partial[triage.StreamingTriageResponse].model_from_chunks(chunks)
+
+
+class StreamClaudeTest(unittest.TestCase):
+    def stream(self, partials):
+        completions = SimpleNamespace(create_partial=lambda **request: partials)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        conversation = ConversationState("system", "opening")
+        spoken = []
+        with mock.patch.object(triage, "client", client), \
+                mock.patch.object(triage.llm_cache, "lookup", return_value=None):
+            response = triage.stream_claude(conversation, lambda text, cache=False: spoken.append(text))
+        return response, spoken
+
+    def test_missing_summary_keeps_the_decision(self):
+        response, spoken = self.stream(partial_stream(FIELDS))
+
+        self.assertEqual(response.final_decision, "alert_emergency")
+        self.assertTrue(response.exit_conversation)
+        self.assertEqual(response.situation_summary, "")
+        self.assertEqual(" ".join(spoken), FIELDS["response_text"])
+
+    def test_truncated_stream_falls_back(self):
+        fields = dict(FIELDS)
+        del fields["final_decision"]
+        del fields["exit_conversation"]
+
+        response, spoken = self.stream(partial_stream(fields))
+
+        self.assertEqual(response.final_decision, "unknown")
+        self.assertEqual(" ".join(spoken), FIELDS["response_text"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,28 +1,50 @@
 import os
+import re
 
 import anthropic
 import instructor
-import pyttsx3
+import llm_cache
 import speech_recognition as sr
 from dotenv import load_dotenv
-from pydantic import BaseModel
-from call_agent import generate_call_message, make_call
+from pydantic import BaseModel, Field
+from call_agent import dispatch_call, dispatch_message
+from conversation import NO_RESPONSE, ConversationState
+from listener import get_listener
+from metrics import timed
+from speech import OPENING_PROMPT, get_speech_worker
 
 # Load environment variables
 load_dotenv()
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-if not ANTHROPIC_API_KEY:
+if not ANTHROPIC_API_KEY and not llm_cache.replaying():
     raise ValueError("Missing Anthropic API key! Please set it in .env file.")
 
-# Initialize Anthropic Client with Instructor
+# Initialize Anthropic Client with Instructor (when replaying from the LLM cache it
+# is never called, so any key will do)
 client = instructor.from_anthropic(
-    anthropic.Anthropic(api_key=ANTHROPIC_API_KEY))
+    anthropic.Anthropic(api_key=ANTHROPIC_API_KEY or "replay"))
 
 # Read the system prompt from file
 with open("prime_triage_prompt.txt", "r", encoding="utf8") as file:
     SYSTEM_PROMPT = file.read()
 
+# Stream responses and start speaking before the whole structured response is done
+STREAMING = os.getenv("TRIAGE_STREAMING", "true").lower() in (
+    "1", "true", "yes")
+
+STREAMING_NOTE = """
+
+When you respond, write `response_text` first, before `reasoning` and the reward fields:
+it is spoken to the person while you finish the rest."""
+
+SUMMARY_DESCRIPTION = (
+    "One or two sentences for an emergency dispatcher, updated every turn: what happened, "
+    "the person's condition and injuries, and whether they are responsive.")
+
+# A sentence ends at . ! or ? followed by whitespace
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
 
 class TriageResponse(BaseModel):
     reasoning: str
@@ -34,126 +56,255 @@ class TriageResponse(BaseModel):
     response_text: str
     exit_conversation: bool
     final_decision: str
+    situation_summary: str = Field("", description=SUMMARY_DESCRIPTION)
 
 
-def call_claude(conversation_history):
-    """Send conversation history to Claude and get a structured response."""
-    if len(conversation_history) < 2:
-        print("\nDEBUG - Not enough messages, adding initial user message.\n")
-        conversation_history.append(
-            {"role": "user", "content": "A possible fall has been detected. Are you okay?"})
+# Same fields, but response_text comes first so it streams out before the rest
+class StreamingTriageResponse(BaseModel):
+    response_text: str
+    reasoning: str
+    decision_speed: int
+    information_gain: int
+    correctness: int
+    false_positives_negatives: int
+    total_reward: int
+    exit_conversation: bool
+    final_decision: str
+    situation_summary: str = Field("", description=SUMMARY_DESCRIPTION)
+
+
+def fallback_response():
+    return TriageResponse(
+        reasoning="Error processing response.",
+        decision_speed=0,
+        information_gain=0,
+        correctness=0,
+        false_positives_negatives=0,
+        total_reward=0,
+        response_text="I'm having trouble processing right now.",
+        exit_conversation=False,
+        final_decision="unknown"
+    )
+
+
+def new_conversation():
+    return ConversationState(SYSTEM_PROMPT, OPENING_PROMPT)
+
+
+def call_claude(conversation):
+    """Send the conversation to Claude and get a structured response."""
+    request = dict(
+        model="claude-3-5-sonnet-20241022",
+        max_tokens=500,
+        temperature=0.5,
+        system=conversation.system(),
+        messages=conversation.messages()
+    )
+
+    def fetch():
+        response, completion = client.chat.completions.create_with_completion(
+            **request, response_model=TriageResponse)
+        conversation.record_usage(completion.usage)
+        return response
 
     try:
-        response = client.chat.completions.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=300,
-            temperature=0.5,
-            system=SYSTEM_PROMPT,
-            messages=conversation_history,
-            response_model=TriageResponse
-        )
+        with timed("claude_call", kind="triage"):
+            return llm_cache.cached(request, fetch, TriageResponse)
 
+    except llm_cache.CacheMiss:
+        # A replay must fail loudly rather than carry on with a made-up reply
+        raise
+    except Exception as e:
+        print(f"Claude API Error: {e}")
+        return fallback_response()
+
+
+def complete_response(partial):
+    """
+    Builds a TriageResponse from the last partial of a stream. Every field of a partial
+    is optional, so fields the stream never reached (the summary comes last) are left
+    to their defaults instead of failing validation.
+    """
+    return TriageResponse(**{field: value for field, value in partial.model_dump().items()
+                             if value is not None})
+
+
+def split_sentences(text):
+    """Splits text into complete sentences and the unfinished remainder."""
+    parts = SENTENCE_END.split(text)
+    return [p for p in parts[:-1] if p.strip()], parts[-1]
+
+
+def stream_claude(conversation, speak):
+    """
+    Streams a structured response from Claude. response_text is handed to speak()
+    one sentence at a time as it arrives, while the remaining fields are still
+    being generated. Returns the complete TriageResponse.
+    """
+    request = dict(
+        model="claude-3-5-sonnet-20241022",
+        max_tokens=500,
+        temperature=0.5,
+        system=conversation.system(STREAMING_NOTE),
+        messages=conversation.messages()
+    )
+
+    spoken = 0
+    partial = None
+    try:
+        recorded = llm_cache.lookup(request, StreamingTriageResponse)
+        if recorded is not None:
+            sentences, rest = split_sentences(recorded.response_text)
+            for sentence in sentences + [rest]:
+                if sentence.strip():
+                    speak(sentence.strip())
+            spoken = len(recorded.response_text)
+            return TriageResponse(**recorded.model_dump())
+
+        with timed("claude_call", kind="triage_stream"):
+            for partial in client.chat.completions.create_partial(
+                **request,
+                response_model=StreamingTriageResponse
+            ):
+                text = partial.response_text or ""
+                sentences, _ = split_sentences(text[spoken:])
+                for sentence in sentences:
+                    speak(sentence.strip())
+                    spoken = text.index(sentence, spoken) + len(sentence)
+
+                # Once the next field starts, response_text is final
+                if partial.reasoning is not None and text[spoken:].strip():
+                    speak(text[spoken:].strip())
+                    spoken = len(text)
+
+        text = partial.response_text or ""
+        if text[spoken:].strip():
+            speak(text[spoken:].strip())
+
+        # Partial streams don't expose the API usage, so estimate it
+        conversation.estimate_usage(partial.model_dump_json(), STREAMING_NOTE)
+        response = complete_response(partial)
+        llm_cache.store(request, response, StreamingTriageResponse)
         return response
 
+    except llm_cache.CacheMiss:
+        # A replay must fail loudly rather than carry on with a made-up reply
+        raise
     except Exception as e:
         print(f"Claude API Error: {e}")
-        return TriageResponse(
-            reasoning="Error processing response.",
-            decision_speed=0,
-            information_gain=0,
-            correctness=0,
-            false_positives_negatives=0,
-            total_reward=0,
-            response_text="I'm having trouble processing right now.",
-            exit_conversation=False,
-            final_decision="unknown"
-        )
-
-
-def text_to_speech(text):
-    engine = pyttsx3.init()
-    engine.say(text)
-    engine.runAndWait()
-
-
-def speech_to_text():
-    recognizer = sr.Recognizer()
-    with sr.Microphone() as source:
-        recognizer.adjust_for_ambient_noise(source)
+        response = fallback_response()
+        if spoken == 0:
+            speak(response.response_text, cache=True)
+        return response
+
+
+def text_to_speech(text, cache=False):
+    """Speaks text on the shared speech worker and waits until it has been said."""
+    get_speech_worker().say(text, cache=cache).wait()
+
+
+def speech_to_text(audio):
+    listener = get_listener()
+    with timed("stt"):
         try:
-            audio = recognizer.listen(source, timeout=5)
-            text = recognizer.recognize_google(audio)
+            text = listener.recognizer.recognize_google(audio)
             print(text)
             return {"text": text}
         except sr.UnknownValueError:
             return {"text": "Could not understand the audio."}
         except sr.RequestError:
             return {"text": "Error: Check your internet connection."}
-        except sr.WaitTimeoutError:
-            return {"text": "Listening timed out."}
 
 
 # Function to handle waiting for a response, then transitioning if needed
 def get_user_input_or_timeout(timeout=6):
     """Passively waits for user input for 'timeout' seconds. If no input, returns None."""
-    print("\n(Waiting for response... 6 seconds before timeout)")
+    print(f"\n(Waiting for response... {timeout} seconds before timeout)")
 
-    # TODO: add timeout
+    # The listener has been capturing all along, so a reply that started while
+    # we were still talking is already here
+    audio = get_listener().next_utterance(timeout)
+    if audio is None:
+        return None  # No input received within timeout
 
-    return speech_to_text()  # Read input if available
-    # return None  # No input received within timeout
+    return speech_to_text(audio)
 
 
-def triaging_agent(message_q):
-    """Handles back-and-forth triaging until a clear decision is made."""
-    conversation_history = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": "A possible fall has been detected. Are you okay?"}
-    ]
+def triaging_agent(message_q, on_escalate=None):
+    """
+    Handles back-and-forth triaging until a clear decision is made.
+    Starts the emergency call and calls on_escalate (if given) with the call's Future as
+    soon as Claude decides to alert, and returns the final decision.
+    """
+    conversation = new_conversation()
 
     print("\nFall detected. Initiating triage...\n")
 
+    # The microphone stays open for the whole session and hears us talking
+    speech = get_speech_worker()
+    listener = get_listener()
+    if listener.mark_speaking not in speech.speaking_callbacks:
+        speech.speaking_callbacks.append(listener.mark_speaking)
+    listener.activate()
+
+    # The opening prompt is pre-rendered, so it plays while Claude works on a reply
+    speech.say(OPENING_PROMPT, cache=True)
+
+    try:
+        return _triage_loop(message_q, on_escalate, conversation, speech)
+    finally:
+        listener.deactivate()
+
+
+def _triage_loop(message_q, on_escalate, conversation, speech):
+    """One Claude turn and one user reply per iteration until Claude exits."""
     while True:
-        # Call Claude with the conversation history
-        response = call_claude(conversation_history)
+        # Call Claude with the conversation so far; when streaming, the reply
+        # is already being spoken by the time this returns
+        if STREAMING:
+            response = stream_claude(conversation, speech.say)
+        else:
+            response = call_claude(conversation)
 
         # Print debug information
         print(f"\nDEBUG - Reasoning: {response.reasoning}")
         print(f"DEBUG - Rewards: Decision Spservereed: {response.decision_speed}, Information Gain: {response.information_gain}, Correctness: {response.correctness}, False Positives/Negatives: {response.false_positives_negatives}, Total Reward: {response.total_reward}")
 
+        conversation.update_summary(response.situation_summary)
+
+        # Start the call right away, while the reply is still being spoken
+        if response.exit_conversation and response.final_decision == "alert_emergency":
+            print("Claude: Contacting emergency services...")
+            dispatch = dispatch_call(dispatch_message(
+                conversation.situation_summary, conversation.last_user_reply()))
+            if on_escalate is not None:
+                on_escalate(dispatch)
+
         # Print Claude's response
         print(f"\nClaude: {response.response_text}")
-        text_to_speech(response.response_text)
+        if not STREAMING:
+            speech.say(response.response_text)
         message_q.put({"speaker": "ai", "text": response.response_text})
+        speech.wait()
 
         # Add Claude's response to conversation history
-        conversation_history.append(
-            {"role": "assistant", "content": response.response_text})
+        conversation.add_assistant(response.response_text)
 
         # **Exit automatically if the AI determines it should**
         if response.exit_conversation:
-            if response.final_decision == "alert_emergency":
-                print("Claude: Contacting emergency services...")
-                context = str(conversation_history)
-                message = generate_call_message(context)
-                make_call(message)
-
             print("\nClaude: Triage complete. Ending session.")
-            break
+            return response.final_decision
 
         # Get user response (or timeout)
         user_input = get_user_input_or_timeout()
 
         if user_input is None:
             print("\nNo response detected. Checking again...")
-            conversation_history.append(
-                {"role": "user", "content": "(No response detected)"})
-            message_q.put(
-                {"speaker": "user", "text": "(No response detected)"})
+            conversation.add_user(NO_RESPONSE)
+            message_q.put({"speaker": "user", "text": NO_RESPONSE})
         else:
             # Add user input to conversation history
-            conversation_history.append(
-                {"role": "user", "content": user_input["text"]})
+            conversation.add_user(user_input["text"])
             message_q.put({"speaker": "user", "text": user_input["text"]})
 
 
@@ -0,0 +1,152 @@
+import threading
+import time
+
+# Session states
+IDLE = "idle"
+ACTIVE = "active"
+ESCALATED = "escalated"
+DONE = "done"
+
+# Emergency call states
+PENDING = "pending"
+PLACED = "placed"
+FAILED = "failed"
+
+
+class SessionMessages:
+    """Passes triage messages on to the dashboard queue and records them under their session."""
+
+    def __init__(self, message_q, event_store, session_id):
+        self.message_q = message_q
+        self.event_store = event_store
+        self.session_id = session_id
+
+    def put(self, message):
+        self.message_q.put(message)
+        if self.event_store is not None:
+            self.event_store.put("triage_message", message,
+                                 session_id=self.session_id)
+
+
+class TriageSessionManager:
+    """
+    Runs each triage session on its own worker thread so the capture loop never
+    blocks on Claude calls, speech or the microphone.
+    Fall events that arrive while a session is active are dropped.
+    """
+
+    def __init__(self, agent, message_q, event_store=None):
+        self.agent = agent
+        self.message_q = message_q
+        self.event_store = event_store
+        self.camera_id = None
+        self.state = IDLE
+        self.session_id = 0
+        self.started_at = None
+        self.ended_at = None
+        self.final_decision = None
+        self.dispatch = None
+        self.dispatch_error = None
+        self.dropped_events = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def is_active(self):
+        return self.state in (ACTIVE, ESCALATED)
+
+    def start(self, camera_id=None):
+        """Starts a new session unless one is already running. Returns True if started."""
+        with self._lock:
+            if self.is_active():
+                self.dropped_events += 1
+                return False
+
+            self.session_id += 1
+            self.camera_id = camera_id
+            self.state = ACTIVE
+            self.started_at = time.time()
+            self.ended_at = None
+            self.final_decision = None
+            self.dispatch = None
+            self.dispatch_error = None
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(self.session_id,),
+                name=f"triage-session-{self.session_id}",
+                daemon=True
+            )
+            self._thread.start()
+
+        print(f"[Triage] Started session {self.session_id}.")
+        self._record("triage_started", {})
+        return True
+
+    def _record(self, event_type, data, session_id=None):
+        if self.event_store is not None:
+            self.event_store.put(event_type, data, camera_id=self.camera_id,
+                                 session_id=session_id or self.session_id)
+
+    def _escalate(self, session_id, dispatch=None):
+        with self._lock:
+            if self.state == ACTIVE:
+                self.state = ESCALATED
+            if dispatch is not None:
+                self.dispatch = PENDING
+        print(f"[Triage] Session {session_id} escalated.")
+        self._record("triage_escalated", {}, session_id)
+        if dispatch is not None:
+            dispatch.add_done_callback(
+                lambda future: self._dispatch_done(session_id, future))
+
+    def _dispatch_done(self, session_id, future):
+        """Records how the emergency call went; a failed call is also said on /triage."""
+        error = future.exception()
+        with self._lock:
+            if session_id == self.session_id:
+                self.dispatch = PLACED if error is None else FAILED
+                self.dispatch_error = None if error is None else str(error)
+
+        if error is None:
+            self._record("dispatch_placed", {"sid": future.result()}, session_id)
+            return
+        print(f"[Triage] Session {session_id}: emergency call failed: {error}")
+        self._record("dispatch_failed", {"error": str(error)}, session_id)
+        SessionMessages(self.message_q, self.event_store, session_id).put({
+            "speaker": "ai",
+            "text": "I couldn't reach emergency services. Please call for help yourself.",
+            "dispatch": FAILED,
+            "error": str(error),
+        })
+
+    def _run(self, session_id):
+        decision = None
+        try:
+            messages = SessionMessages(
+                self.message_q, self.event_store, session_id)
+            decision = self.agent(
+                messages, on_escalate=lambda dispatch=None: self._escalate(session_id, dispatch))
+        except Exception as e:
+            print(f"[Triage] Session {session_id} failed: {e}")
+        finally:
+            with self._lock:
+                self.state = DONE
+                self.ended_at = time.time()
+                self.final_decision = decision
+            print(f"[Triage] Session {session_id} done ({decision}).")
+            self._record("triage_done", {"final_decision": decision,
+                                         "duration": self.ended_at - self.started_at},
+                         session_id)
+
+    def status(self):
+        with self._lock:
+            return {
+                "session_id": self.session_id,
+                "camera_id": self.camera_id,
+                "state": self.state,
+                "started_at": self.started_at,
+                "ended_at": self.ended_at,
+                "final_decision": self.final_decision,
+                "dispatch": self.dispatch,
+                "dispatch_error": self.dispatch_error,
+                "dropped_events": self.dropped_events,
+            }
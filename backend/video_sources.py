@@ -0,0 +1,171 @@
+"""
+Video sources for the camera workers.
+
+open_source() turns a CAMERA_SOURCES entry into a VideoSource:
+
+    0, 1                         webcam by device index
+    recording.mp4                video file, played at its own frame rate
+    frames/*.jpg, frames/        image sequence (sorted by name)
+    rtsp://..., http(s)://...    network stream, reopened if it drops
+    replay:recording.mp4         replay of a file or image sequence
+
+A replay decodes frames as fast as the pipeline takes them (or at replay_speed times
+real time) and stamps each one with a simulated capture time, start + index / fps.
+Everything downstream (sampling clocks, motion gating, batching, staleness checks,
+clips) runs on those timestamps, and the camera worker handles each VLM reply a fixed
+simulated time after its batch (REPLAY_VLM_LATENCY). Hours of footage go through
+detection in minutes, and a run over the same file makes the same decisions every
+time as long as the VLM gives the same verdicts.
+"""
+import glob
+import os
+import time
+
+import cv2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Multiple of real time for replays; 0 means as fast as the pipeline can go
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "0"))
+# Frame rate of image sequences, and of replays whose file doesn't say
+DEFAULT_FPS = 30.0
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class VideoSource:
+    """A stream of (frame, capture timestamp) pairs; read() returns None at the end."""
+
+    # Frames carry simulated timestamps rather than the wall clock
+    simulated = False
+    # Nominal frame rate, or None if unknown
+    fps = None
+
+    def read(self):
+        raise NotImplementedError
+
+    def clock(self):
+        """Current time on the clock the frame timestamps use."""
+        return time.time()
+
+    def close(self):
+        pass
+
+
+class CaptureSource(VideoSource):
+    """Webcam or video file through OpenCV."""
+
+    def __init__(self, target):
+        self.target = target
+        self.cap = cv2.VideoCapture(target)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open {target}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or None
+
+    def read(self):
+        ret, frame = self.cap.read()
+        return (frame, time.time()) if ret else None
+
+    def close(self):
+        self.cap.release()
+
+
+class StreamSource(CaptureSource):
+    """RTSP or HTTP stream; reopens the stream with backoff when a read fails."""
+
+    def __init__(self, url, reconnect_attempts=5, backoff_base=1.0):
+        super().__init__(url)
+        self.reconnect_attempts = reconnect_attempts
+        self.backoff_base = backoff_base
+        self.reconnects = 0
+
+    def read(self):
+        for attempt in range(self.reconnect_attempts + 1):
+            if attempt:
+                delay = self.backoff_base * 2 ** (attempt - 1)
+                print(f"Stream {self.target} dropped, reopening in {delay:.0f}s.")
+                time.sleep(delay)
+                self.cap.release()
+                self.cap = cv2.VideoCapture(self.target)
+                self.reconnects += 1
+            ret, frame = self.cap.read()
+            if ret:
+                return frame, time.time()
+        return None
+
+
+class ImageSequenceSource(VideoSource):
+    """Still images played back in name order at fps."""
+
+    def __init__(self, pattern, fps=DEFAULT_FPS):
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name) for name in os.listdir(pattern)
+                     if name.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            paths = glob.glob(pattern)
+        self.paths = sorted(paths)
+        if not self.paths:
+            raise IOError(f"No images match {pattern}")
+        self.fps = fps
+        self.index = 0
+
+    def read(self):
+        while self.index < len(self.paths):
+            path = self.paths[self.index]
+            self.index += 1
+            frame = cv2.imread(path)
+            if frame is not None:
+                return frame, time.time()
+            print(f"Skipping unreadable image {path}")
+        return None
+
+
+class ReplaySource(VideoSource):
+    """Replays a file or image sequence with simulated timestamps."""
+
+    simulated = True
+
+    def __init__(self, source, speed=REPLAY_SPEED, start=None):
+        self.source = source
+        self.speed = speed
+        self.fps = source.fps or DEFAULT_FPS
+        self.start = time.time() if start is None else start
+        self.frames = 0
+        self.now = self.start
+
+    def read(self):
+        frame = self.source.read()
+        if frame is None:
+            return None
+        self.now = self.start + self.frames / self.fps
+        self.frames += 1
+        return frame[0], self.now
+
+    def clock(self):
+        return self.now
+
+    def close(self):
+        self.source.close()
+
+
+def is_image_sequence(spec):
+    return os.path.isdir(spec) or any(c in spec for c in "*?[")
+
+
+def open_source(spec, replay_speed=None):
+    """Opens a CAMERA_SOURCES entry (see the module docstring). Raises IOError if it can't be opened."""
+    if isinstance(spec, int):
+        return CaptureSource(spec)
+
+    if spec.startswith("replay:"):
+        target = spec[len("replay:"):]
+        if "://" in target:
+            raise ValueError(f"Only files and image sequences can be replayed: {target}")
+        source = ImageSequenceSource(target) if is_image_sequence(target) else CaptureSource(target)
+        return ReplaySource(source, REPLAY_SPEED if replay_speed is None else replay_speed)
+
+    if spec.split("://", 1)[0].lower() in ("rtsp", "rtsps", "http", "https"):
+        return StreamSource(spec)
+    if is_image_sequence(spec):
+        return ImageSequenceSource(spec)
+    return CaptureSource(spec)
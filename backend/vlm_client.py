@@ -0,0 +1,266 @@
+"""
+Pipelined client for the external VLM WebSocket server.
+
+Instead of stop-and-wait, up to max_in_flight batches can be outstanding at once.
+Each batch carries a sequence ID and its frame capture timestamps in the container
+metadata (see frame_codec.py). The server is expected to echo "seq" back in its JSON
+response; if it doesn't, responses are matched to batches in send order. Batches go
+over the process-wide VLMConnection (see vlm_link.py).
+
+Responses are handed back in sequence order. A response is discarded if it is for a
+batch older than one already delivered, if its frames are older than stale_after
+seconds, or if its batch was given up on after reorder_timeout seconds. Frame age is
+measured on frame_clock, which for a replayed file is its simulated clock.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+
+@dataclass
+class VLMBatch:
+    seq: int
+    timestamps: list
+    num_frames: int
+    sent_at: float = None
+
+
+@dataclass
+class VLMResult:
+    seq: int
+    start_ts: float
+    end_ts: float
+    num_frames: int
+    round_trip: float
+    response: dict = field(default_factory=dict)
+
+
+class SlidingWindow:
+    """
+    Frame window for VLM batches. Keeps the newest frames and is ready every `hop`
+    new frames, so consecutive windows overlap by size - hop frames. If a window
+    can't go out right away, frames keep accumulating (up to max_size) and the
+    next window stretches back to cover the gap, so no time span is skipped.
+    """
+
+    def __init__(self, size, hop=None, max_size=None):
+        self.frames = deque()
+        self.timestamps = deque()
+        self.new_frames = 0
+        self.resize(size, hop, max_size)
+
+    def resize(self, size, hop=None, max_size=None):
+        self.size = max(1, size)
+        self.hop = max(1, min(hop or self.size, self.size))
+        self.max_size = max(self.size, max_size or 2 * self.size)
+        self._trim()
+
+    def push(self, frame, ts):
+        self.frames.append(frame)
+        self.timestamps.append(ts)
+        self.new_frames += 1
+        self._trim()
+
+    def ready(self):
+        return self.new_frames >= self.hop and len(self.frames) >= self.size
+
+    def take(self, count=None):
+        """Returns (frames, timestamps) for the next window and restarts the hop count."""
+        backlog = max(0, self.new_frames - self.hop)
+        count = count or self.size + backlog
+        count = min(count, len(self.frames))
+        frames = list(self.frames)[-count:]
+        timestamps = list(self.timestamps)[-count:]
+        self.new_frames = 0
+        return frames, timestamps
+
+    def skip(self):
+        """Lets a ready window pass without sending it."""
+        self.new_frames = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _trim(self):
+        while len(self.frames) > self.max_size:
+            self.frames.popleft()
+            self.timestamps.popleft()
+
+
+class VLMPipeline:
+    """
+    Queues one camera's batches and sends them over a shared VLMConnection on a
+    sender thread; replies are routed back here by the connection.
+    """
+
+    def __init__(self, connection, max_in_flight=2, stale_after=15.0, reorder_timeout=10.0,
+                 clock=time.time, frame_clock=None):
+        self.connection = connection
+        self.max_in_flight = max_in_flight
+        self.stale_after = stale_after
+        self.reorder_timeout = reorder_timeout
+        self.clock = clock
+        self.frame_clock = frame_clock or clock
+
+        self.next_seq = 0
+        self.next_deliver = 0
+        self.in_flight = {}
+        self.ready = {}
+        self.discarded = 0
+        self.replayed = 0
+        self.batches_sent = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        # Most recent window, re-sent after a reconnect
+        self.last_window = None
+
+        self._lock = threading.Lock()
+        self._send_queue = queue.Queue()
+        self._sender = threading.Thread(target=self._send_loop, daemon=True)
+
+    @property
+    def connected(self):
+        return self.connection.connected
+
+    def start(self):
+        self.connection.attach(self)
+        self._sender.start()
+
+    def has_capacity(self):
+        with self._lock:
+            return self.connected and len(self.in_flight) < self.max_in_flight
+
+    def submit(self, frames, timestamps):
+        """Queues a batch for sending. Returns its sequence ID, or None if the pipeline is full."""
+        with self._lock:
+            if not self.connected or len(self.in_flight) >= self.max_in_flight:
+                return None
+            seq = self.next_seq
+            self.next_seq += 1
+            batch = VLMBatch(seq=seq, timestamps=list(timestamps),
+                             num_frames=len(frames))
+            self.in_flight[seq] = batch
+            self.last_window = (frames, batch.timestamps)
+
+        self._send_queue.put((batch, frames))
+        return seq
+
+    def on_disconnect(self):
+        """The link dropped: replies for in-flight batches will never come."""
+        with self._lock:
+            self.discarded += len(self.in_flight)
+            self.in_flight.clear()
+
+    def on_reconnect(self):
+        """The link is back: re-send the last window if it is still worth analyzing."""
+        window = self.last_window
+        if window is None or not window[1]:
+            return
+        frames, timestamps = window
+        if self.frame_clock() - timestamps[-1] > self.stale_after:
+            return
+        if self.submit(frames, timestamps) is not None:
+            self.replayed += 1
+            print(f"[VLM] Re-sent last window ({len(frames)} frames) after reconnecting.")
+
+    def settled(self, seq):
+        """Whether batch seq has been answered or given up on."""
+        with self._lock:
+            return seq not in self.in_flight
+
+    def poll(self, through=None):
+        """
+        Returns the responses that are ready, in sequence order, stopping after batch
+        through if given. Never blocks.
+        """
+        now = self.clock()
+        frame_now = self.frame_clock()
+        last = self.next_seq if through is None else min(through + 1, self.next_seq)
+        results = []
+        with self._lock:
+            while self.next_deliver < last:
+                seq = self.next_deliver
+                if seq in self.ready:
+                    result = self.ready.pop(seq)
+                    if frame_now - result.end_ts > self.stale_after:
+                        print(
+                            f"[VLM] Discarding stale response for batch {seq}.")
+                        self.discarded += 1
+                    else:
+                        results.append(result)
+                elif seq in self.in_flight:
+                    batch = self.in_flight[seq]
+                    if batch.sent_at is None or now - batch.sent_at < self.reorder_timeout:
+                        break
+                    # Give up on this batch so later responses aren't held back
+                    print(f"[VLM] No response for batch {seq}, skipping it.")
+                    del self.in_flight[seq]
+                    self.discarded += 1
+                self.next_deliver += 1
+        return results
+
+    def close(self):
+        """Stops the sender; the shared connection stays up for other cameras."""
+        self._send_queue.put(None)
+        self.connection.detach(self)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connected": self.connected,
+                "in_flight": len(self.in_flight),
+                "send_queue": self._send_queue.qsize(),
+                "ready": len(self.ready),
+                "batches_sent": self.batches_sent,
+                "frames_sent": self.frames_sent,
+                "bytes_sent": self.bytes_sent,
+                "discarded": self.discarded,
+                "replayed": self.replayed,
+            }
+
+    def _send_loop(self):
+        while True:
+            item = self._send_queue.get()
+            if item is None:
+                break
+
+            batch, frames = item
+            try:
+                batch.sent_at = self.clock()
+                size = self.connection.send_batch(
+                    self, batch.seq, frames, batch.timestamps)
+                self.batches_sent += 1
+                self.frames_sent += batch.num_frames
+                self.bytes_sent += size
+                print(
+                    f"[VLM] Sent batch {batch.seq}: {batch.num_frames} frames ({size} bytes).")
+            except Exception as e:
+                print(f"[VLM] Failed to send batch {batch.seq}: {e}")
+                with self._lock:
+                    if self.in_flight.pop(batch.seq, None) is not None:
+                        self.discarded += 1
+
+    def _on_response(self, response):
+        now = self.clock()
+        with self._lock:
+            seq = response.get("seq")
+            if seq is None and self.in_flight:
+                # Server didn't echo a sequence ID; assume it answers in send order
+                seq = min(self.in_flight)
+
+            batch = self.in_flight.pop(seq, None)
+            if batch is None:
+                # Late reply for a batch we already gave up on
+                self.discarded += 1
+                return
+
+            self.ready[seq] = VLMResult(
+                seq=seq,
+                start_ts=batch.timestamps[0] if batch.timestamps else now,
+                end_ts=batch.timestamps[-1] if batch.timestamps else now,
+                num_frames=batch.num_frames,
+                round_trip=now - (batch.sent_at or now),
+                response=response
+            )
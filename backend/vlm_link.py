@@ -0,0 +1,301 @@
+"""
+Persistent connection to the external VLM server.
+
+There is one VLMConnection per server URL for the whole process. It connects as soon
+as it is created (before any camera needs it) and stays up: a WebSocket ping goes out
+every ping_interval, and a link that has been silent for longer than ping_interval +
+pong_timeout is treated as dead. A dead or failed link reconnects with exponential
+backoff and jitter, so a server restart doesn't trigger a thundering herd.
+
+Every camera's VLMPipeline sends through the shared link. Batches get a
+connection-wide sequence ID on the wire, and the server's reply is routed back to
+the pipeline that sent it under that pipeline's own sequence ID. When the link
+drops, pipelines give up on their in-flight batches right away instead of waiting
+for a timeout; when it comes back, each one re-sends its last window, so the seconds
+around the outage still get analyzed.
+
+health() reports the link state for /health and /metrics.
+"""
+import json
+import random
+import threading
+import time
+
+import websocket
+from frame_codec import pack_frames
+
+# Replies that never came are forgotten after this many seconds
+ROUTE_TIMEOUT = 60.0
+
+
+class VLMConnection:
+    def __init__(self, url, ping_interval=10.0, pong_timeout=5.0, connect_timeout=10.0,
+                 backoff_base=0.5, backoff_max=30.0):
+        self.url = url
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.connect_timeout = connect_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.connected = False
+        self.connects = 0
+        self.failures = 0
+        self.last_error = None
+        self.connected_since = None
+        self.down_since = time.time()
+        self.downtime = 0.0
+        self.ping_rtt = None
+        self.last_received = None
+        # Called with health() whenever the link goes up or down
+        self.listeners = []
+
+        self._ws = None
+        self._pipelines = set()
+        self._routes = {}  # wire seq -> (pipeline, pipeline seq, sent at)
+        self._next_wire_seq = 0
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="vlm-link", daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+
+    def close(self):
+        self._closed.set()
+        self._drop()
+
+    def attach(self, pipeline):
+        with self._lock:
+            self._pipelines.add(pipeline)
+
+    def detach(self, pipeline):
+        with self._lock:
+            self._pipelines.discard(pipeline)
+            self._routes = {wire: route for wire, route in self._routes.items()
+                            if route[0] is not pipeline}
+
+    def send_batch(self, pipeline, seq, frames, timestamps):
+        """
+        Sends one batch for pipeline and returns its size in bytes. Raises
+        ConnectionError if the link is down or the send fails.
+        """
+        with self._lock:
+            ws = self._ws
+            if not self.connected or ws is None:
+                raise ConnectionError("VLM link is down")
+            wire_seq = self._next_wire_seq
+            self._next_wire_seq += 1
+            self._routes[wire_seq] = (pipeline, seq, time.time())
+
+        message = pack_frames(
+            frames, {"seq": wire_seq, "timestamps": list(timestamps)})
+        try:
+            with self._send_lock:
+                ws.send_binary(message)
+        except Exception as e:
+            with self._lock:
+                self._routes.pop(wire_seq, None)
+            # Fail fast: take the link down now rather than on the next ping
+            self._drop(ws)
+            raise ConnectionError(f"VLM send failed: {e}") from e
+        return len(message)
+
+    def health(self):
+        now = time.time()
+        with self._lock:
+            return {
+                "url": self.url,
+                "connected": self.connected,
+                "connects": self.connects,
+                "reconnects": max(0, self.connects - 1),
+                "failures": self.failures,
+                "last_error": self.last_error,
+                "up_for": now - self.connected_since if self.connected else None,
+                "down_for": now - self.down_since if not self.connected else None,
+                "downtime": self.downtime + (now - self.down_since if not self.connected else 0.0),
+                "ping_rtt": self.ping_rtt,
+                "last_received_age": now - self.last_received if self.last_received else None,
+                "pipelines": len(self._pipelines),
+                "awaiting_replies": len(self._routes),
+            }
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        attempt = 0
+        while not self._closed.is_set():
+            try:
+                ws = websocket.create_connection(
+                    self.url, timeout=self.connect_timeout)
+                ws.settimeout(None)
+            except Exception as e:
+                delay = self._backoff(attempt)
+                attempt += 1
+                with self._lock:
+                    self.failures += 1
+                    self.last_error = str(e)
+                print(
+                    f"[VLM] Could not connect to {self.url} ({e}), retrying in {delay:.1f}s.")
+                self._closed.wait(delay)
+                continue
+
+            attempt = 0
+            self._on_connect(ws)
+            reason = self._keepalive(ws)
+            self._on_disconnect(ws, reason)
+
+    def _keepalive(self, ws):
+        """Reads on a helper thread and pings on this one until the link dies. Returns why."""
+        done = threading.Event()
+        reason = []
+
+        def read():
+            reason.append(self._read_loop(ws))
+            done.set()
+
+        threading.Thread(target=read, name="vlm-link-reader",
+                         daemon=True).start()
+
+        while not done.wait(self.ping_interval):
+            if self._closed.is_set():
+                reason.append("closed")
+                break
+            silent = time.time() - (self.last_received or 0)
+            if silent > self.ping_interval + self.pong_timeout:
+                reason.append(f"no reply for {silent:.0f}s")
+                break
+            try:
+                with self._send_lock:
+                    ws.ping(repr(time.monotonic()))
+            except Exception as e:
+                reason.append(f"ping failed: {e}")
+                break
+            self._prune_routes()
+
+        self._drop(ws)
+        done.wait(self.connect_timeout)
+        return reason[0] if reason else "unknown"
+
+    def _read_loop(self, ws):
+        while True:
+            try:
+                opcode, data = ws.recv_data(control_frame=True)
+            except Exception as e:
+                return f"receive failed: {e}"
+            self.last_received = time.time()
+
+            if opcode == websocket.ABNF.OPCODE_PONG:
+                try:
+                    self.ping_rtt = time.monotonic() - float(data)
+                except ValueError:
+                    pass
+            elif opcode == websocket.ABNF.OPCODE_CLOSE:
+                return "closed by server"
+            elif opcode in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY) and data:
+                self._on_message(data)
+
+    def _on_message(self, data):
+        try:
+            response = json.loads(data)
+        except ValueError:
+            print(f"[VLM] Ignoring malformed response: {data!r}")
+            return
+
+        with self._lock:
+            wire_seq = response.get("seq")
+            if wire_seq is None and self._routes:
+                # Server didn't echo a sequence ID; assume it answers in send order
+                wire_seq = min(self._routes)
+            route = self._routes.pop(wire_seq, None)
+        if route is None:
+            return
+
+        pipeline, seq, _ = route
+        response["seq"] = seq
+        pipeline._on_response(response)
+
+    def _on_connect(self, ws):
+        now = time.time()
+        with self._lock:
+            self._ws = ws
+            self.connected = True
+            self.connects += 1
+            self.last_received = now
+            self.connected_since = now
+            self.downtime += now - self.down_since
+            reconnect = self.connects > 1
+            pipelines = list(self._pipelines)
+        print(f"[VLM] {'Reconnected' if reconnect else 'Connected'} to {self.url}.")
+
+        if reconnect:
+            for pipeline in pipelines:
+                pipeline.on_reconnect()
+        self._notify()
+
+    def _on_disconnect(self, ws, reason):
+        with self._lock:
+            if self._ws is ws:
+                self._ws = None
+            self.connected = False
+            self.down_since = time.time()
+            self.last_error = reason
+            # Replies for batches sent on the dead socket will never come
+            self._routes.clear()
+            pipelines = list(self._pipelines)
+        print(f"[VLM] Lost connection to {self.url}: {reason}")
+
+        for pipeline in pipelines:
+            pipeline.on_disconnect()
+        self._notify()
+
+    def _drop(self, ws=None):
+        """Closes the socket without a close handshake, which unblocks the reader."""
+        with self._lock:
+            ws = ws or self._ws
+            if ws is self._ws:
+                self.connected = False
+        if ws is not None:
+            try:
+                ws.shutdown()
+            except Exception:
+                pass
+
+    def _prune_routes(self):
+        cutoff = time.time() - ROUTE_TIMEOUT
+        with self._lock:
+            self._routes = {wire: route for wire, route in self._routes.items()
+                            if route[2] >= cutoff}
+
+    def _notify(self):
+        health = self.health()
+        for listener in self.listeners:
+            try:
+                listener(health)
+            except Exception as e:
+                print(f"[VLM] Link listener failed: {e}")
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_vlm_connection(url):
+    """Returns the process-wide connection to url, connecting on first use."""
+    with _connections_lock:
+        connection = _connections.get(url)
+        if connection is None or connection._closed.is_set():
+            connection = VLMConnection(url)
+            connection.start()
+            _connections[url] = connection
+        return connection
+
+
+def vlm_connections():
+    with _connections_lock:
+        return list(_connections.values())
@@ -95,7 +95,7 @@ export default function Dashboard() {
     return () => {
       socket.close();
     }
-  })
+  }, [])
 
   return (
     <Container id="triage" sx={{ py: { xs: 4, sm: 8 }, height: "100vh" }}>
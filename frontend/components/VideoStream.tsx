@@ -65,23 +65,40 @@ export default function VideoStream() {
   //
   // 1) WebSocket for the video feed
   //
+  // Frames arrive as raw JPEG bytes; each one is shown through an object URL
+  // and the previous URL is revoked so blobs don't pile up.
+  const frameUrlRef = useRef<string | null>(null);
+
   useEffect(() => {
     const ws = new WebSocket("ws://localhost:5001/video_feed");
+    ws.binaryType = "blob";
     ws.onmessage = (event: MessageEvent) => {
-      setImageSrc(`data:image/jpeg;base64,${event.data}`);
+      const url = URL.createObjectURL(
+        new Blob([event.data], { type: "image/jpeg" })
+      );
+      if (frameUrlRef.current) {
+        URL.revokeObjectURL(frameUrlRef.current);
+      }
+      frameUrlRef.current = url;
+      setImageSrc(url);
     };
     return () => {
       ws.close();
+      if (frameUrlRef.current) {
+        URL.revokeObjectURL(frameUrlRef.current);
+        frameUrlRef.current = null;
+      }
     };
   }, []);
 
   //
-  // 2) WebSocket for frame rate updates
+  // 2) WebSocket for rate controller decisions
+  //    ({ framerate, batch_frames, scale, reason, camera_id, round_trip })
   //
   useEffect(() => {
     const ws2 = new WebSocket("ws://localhost:5001/frame_update");
     ws2.onmessage = (event: MessageEvent) => {
-      const newFrameRate = parseInt(event.data, 10);
+      const newFrameRate = Number(JSON.parse(event.data).framerate);
 
       if (oldFrameRateRef.current !== null) {
         if (newFrameRate > oldFrameRateRef.current) {